@@ -0,0 +1,144 @@
+"""端到端基准测试：在本地模拟服务器上运行各种流程配置，报告每个阶段的耗时与传输字节数
+
+阶段耗时来自流程的步骤记录（telemetry.Span），流水线模式下各阶段重叠，
+同一阶段各组的耗时累加为该阶段的忙碌时间，传输字节为步骤期间全部传输的字节数。
+
+用法:
+    python benchmark.py --pairs 8 --latency 80 --bandwidth 4096 --stage-delay 0.3
+    python benchmark.py --variants sequential pipelined --json result.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from fake_server import FakeServer, build_layout
+from fusion_pipeline import FusionPipeline, PipelinedFusion, PipelineEvents
+from ssh_pool import shared_pool
+from transfer import format_size
+from remote_layout import CAS_DIR
+from telemetry import span_duration
+
+# 各配置对应的流程参数
+VARIANTS = {
+    "sequential": {},
+    "pipelined": {"pipelined": True},
+    "worker": {"use_worker": True},
+    "bundle": {"bundle": "always"},
+    "per-file": {"bundle": "never"},
+    "single-channel": {"concurrency": 1, "bundle": "never"},
+    "preprocess": {"preprocess": {"max_size": 1024, "quality": 85}},
+}
+
+
+class SpanCollector(PipelineEvents):
+    """收集流程的步骤耗时记录"""
+
+    def __init__(self):
+        self.spans = []
+
+    def on_span(self, span):
+        self.spans.append(span)
+
+
+def make_pairs(folder, count, width, height):
+    """生成count组随机噪声图片（难以压缩，接近真实照片的体积）"""
+    from PIL import Image
+
+    pairs = []
+    for slot in ["input1", "input2"]:
+        os.makedirs(os.path.join(folder, slot), exist_ok=True)
+    for i in range(count):
+        pair = []
+        for slot in ["input1", "input2"]:
+            path = os.path.join(folder, slot, f"{i:04d}.jpg")
+            Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(path, quality=90)
+            pair.append(path)
+        pairs.append(tuple(pair))
+    return pairs
+
+
+def run_variant(name, options, ssh_info, pairs, server_root, output_root):
+    """运行一种配置，返回结果字典"""
+    # 每种配置都从冷连接、空的内容寻址存储开始
+    shared_pool.close_all()
+    shutil.rmtree(os.path.join(server_root, CAS_DIR), ignore_errors=True)
+    options = dict(options)
+    pipelined = options.pop("pipelined", False)
+    output_dir = os.path.join(output_root, name)
+    collector = SpanCollector()
+    pipeline = (PipelinedFusion if pipelined else FusionPipeline)(
+        ssh_info, pairs, output_dir, events=collector, **options
+    )
+    start = time.perf_counter()
+    ok = pipeline.run()
+    # 按步骤汇总；流水线模式下每组各有一条记录，累加得到该步骤的忙碌时间
+    stages = {}
+    for span in collector.spans:
+        if span.stage == "job":
+            continue
+        stage = stages.setdefault(span.stage, {"stage": span.stage, "count": 0, "seconds": 0.0, "bytes": 0})
+        stage["count"] += 1
+        stage["seconds"] += span_duration(span)
+        stage["bytes"] += span.bytes
+    return {
+        "variant": name,
+        "ok": ok,
+        "seconds": time.perf_counter() - start,
+        "bytes": pipeline.transfer_progress.done,
+        "stages": list(stages.values()),
+        "spans": [span._asdict() for span in collector.spans],
+    }
+
+
+def print_result(result):
+    status = "" if result["ok"] else "  ❌ 失败"
+    print(f"\n== {result['variant']}: {result['seconds']:.2f} 秒, {format_size(result['bytes'])}{status}")
+    for stage in result["stages"]:
+        count = f" ×{stage['count']}" if stage["count"] > 1 else ""
+        print(f"   {stage['stage'] + count:<16}{stage['seconds']:8.2f} 秒  {format_size(stage['bytes']):>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UDIS2 流程端到端基准测试（使用本地模拟服务器）")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--pairs", type=int, default=4, help="图片组数")
+    parser.add_argument("--image-size", default="1600x1200", help="输入图片尺寸，宽x高")
+    parser.add_argument("--latency", type=float, default=50, help="往返延迟（毫秒）")
+    parser.add_argument("--bandwidth", type=float, default=0, help="每个方向的带宽（KB/s），0表示不限")
+    parser.add_argument("--stage-delay", type=float, default=0.3, help="每个阶段处理一组图片的耗时（秒）")
+    parser.add_argument("--output-bytes", type=int, default=0, help="每个产物补齐到的字节数，0表示与输入相同")
+    parser.add_argument("--json", help="把结果另存为JSON文件")
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.image_size.lower().split("x"))
+    workdir = tempfile.mkdtemp(prefix="udis_bench_")
+    try:
+        server_root = os.path.join(workdir, "server")
+        build_layout(server_root, args.stage_delay, args.output_bytes)
+        server = FakeServer(server_root, latency=args.latency / 1000, bandwidth=args.bandwidth * 1024).start()
+        ssh_info = {"hostname": "127.0.0.1", "port": server.port, "username": "root", "password": "bench"}
+        pairs = make_pairs(os.path.join(workdir, "inputs"), args.pairs, width, height)
+        print(
+            f"{args.pairs} 组 {args.image_size} 图片，往返延迟 {args.latency:g} 毫秒，"
+            f"带宽 {'不限' if not args.bandwidth else f'{args.bandwidth:g} KB/s'}，每组每阶段 {args.stage_delay:g} 秒"
+        )
+        results = []
+        for name in args.variants:
+            result = run_variant(name, VARIANTS[name], ssh_info, pairs, server_root, os.path.join(workdir, "out"))
+            print_result(result)
+            results.append(result)
+        shared_pool.close_all()
+        server.close()
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        return 0 if all(result["ok"] for result in results) else 1
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
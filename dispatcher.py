@@ -0,0 +1,338 @@
+import json
+import time
+import queue
+import threading
+from ssh_pool import shared_pool
+from transfer import TransferStats
+from fusion_pipeline import FusionPipeline, PipelinedFusion, PipelineEvents, pair_labels, merge_manifest
+from job_queue import JobJournal, remaining_pairs
+
+# 调度参考的阶段：一组图片在服务器上实际占用的时间
+LOAD_STAGES = ("upload", "warp", "composition", "download")
+
+# 记入任务队列的流程参数（缓存只记是否启用）
+STORED_OPTIONS = ["use_worker", "concurrency", "preprocess", "bundle", "compression", "start_stage"]
+
+
+# ============================================================
+#                        服务器状态
+# ============================================================
+class ServerState:
+    """服务器列表中的一台服务器：并发上限、进行中的任务数、最近阶段耗时与健康状态"""
+
+    def __init__(self, ssh_info, max_jobs=1):
+        self.ssh_info = ssh_info
+        # 各组在各自的工作空间中运行，文件互不干扰；但同时推理的组共用一块GPU的显存，
+        # 租用的单卡放不下两组的模型与中间张量时会OOM，默认一次只跑一组，显存充足时在列表中调大
+        self.max_jobs = max_jobs
+        self.in_flight = 0
+        self.latency = None  # 最近每组阶段耗时的指数平滑（秒），尚无记录时为None
+        self.down_until = 0.0  # 判定掉线后在此时间之前不再分配任务
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def name(self):
+        return f"{self.ssh_info['hostname']}:{self.ssh_info['port']}"
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+    def load(self, default_latency):
+        """再分配一组时预计的完成时间：排队组数 × 每组耗时"""
+        return (self.in_flight + 1) * (self.latency or default_latency)
+
+
+def load_roster(path):
+    """读取服务器列表JSON：[{"hostname", "port", "username", "password", "max_jobs"}, ...]"""
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    servers = []
+    for entry in entries:
+        entry = dict(entry)
+        max_jobs = int(entry.pop("max_jobs", 1))
+        entry.setdefault("username", "root")
+        entry["port"] = int(entry.get("port", 22))
+        servers.append(ServerState(entry, max_jobs))
+    return servers
+
+
+# ============================================================
+#                        多服务器分发
+# ============================================================
+class Dispatcher:
+    """把每组图片分发到负载最低的可用服务器，服务器中途掉线时把该组转到其他服务器重跑
+
+    负载按 (进行中的组数 + 1) × 最近每组阶段耗时 估算，还没有耗时记录的服务器按已知最快的计算，
+    因此新加入的服务器会先被试用。每组作为一个独立的FusionPipeline运行，
+    接口与FusionPipeline一致：run() 同步执行并返回是否全部成功。
+    """
+
+    def __init__(self, servers, pairs, output_dir=None, events=None, cooldown=60, smoothing=0.3,
+                 run_log=None, journal=None, labels=None, **options):
+        self.servers = servers  # [ServerState, ...]
+        self.pairs = pairs
+        self.labels = labels or pair_labels(pairs)  # 各组名称，传给每组的FusionPipeline
+        self.output_dir = output_dir
+        self.events = events or PipelineEvents()
+        self.cooldown = cooldown  # 掉线的服务器暂停分配的秒数
+        self.smoothing = smoothing
+        self.run_log = run_log
+        self.journal = journal or JobJournal()  # 按组记录完成情况，恢复时跳过已完成的组
+        self.options = options  # 传给每组FusionPipeline的其余参数
+        self.condition = threading.Condition()
+        self.manifest = {}
+        self.transfers = {}  # {任务回调对象id: 该组最近一次TransferStats}，结束的组保留，总量只增不减
+        self.started = None
+        self.active = set()  # 正在运行的各组流程，取消时逐个取消
+        self.cancelled = threading.Event()
+        self.keep_pending = False
+
+    def run(self):
+        """并发执行全部组，返回是否全部成功"""
+        jobs = queue.Queue()
+        for pair in self.pairs:
+            jobs.put(pair)
+        results = []
+        self.journal.running()
+        self.started = time.monotonic()
+        capacity = sum(server.max_jobs for server in self.servers)
+        workers = [
+            threading.Thread(target=self.worker_loop, args=(jobs, results))
+            for _ in range(min(capacity, len(self.pairs)))
+        ]
+        self.log(f"分发 {len(self.pairs)} 组图片到 {len(self.servers)} 台服务器")
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if self.output_dir is not None and self.manifest:
+            self.write_manifest()
+        for server in self.servers:
+            self.log(f"{server.name}: 完成 {server.completed} 组，失败 {server.failed} 次")
+        ok = len(results) == len(self.pairs) and all(results)
+        if self.cancelled.is_set():
+            ok = False
+            self.log("任务已取消")
+        else:
+            self.log("✅ 全部组处理完成" if ok else "❌ 部分组处理失败")
+        if not (self.cancelled.is_set() and self.keep_pending):
+            self.journal.finish(ok, "已取消" if self.cancelled.is_set() else None)
+        return ok
+
+    def worker_loop(self, jobs, results):
+        while not self.cancelled.is_set():
+            try:
+                pair = jobs.get_nowait()
+            except queue.Empty:
+                return
+            results.append(self.run_pair(pair))
+
+    def run_pair(self, pair):
+        """在一台服务器上处理一组，服务器不可达时换下一台，返回是否成功"""
+        tried = set()
+        while True:
+            server = self.acquire(tried)
+            if server is None:
+                self.log(f"❌ {self.labels[tuple(pair)]} 没有可用的服务器")
+                return False
+            self.log(f"{self.labels[tuple(pair)]} → {server.name}")
+            pipeline = FusionPipeline(
+                server.ssh_info, [pair], self.output_dir,
+                events=JobEvents(self, server), run_log=self.run_log, keep_workspace=False,
+                labels=self.labels, **self.options
+            )
+            with self.condition:
+                self.active.add(pipeline)
+            try:
+                ok = pipeline.run()
+            finally:
+                with self.condition:
+                    self.active.discard(pipeline)
+            if ok:
+                self.release(server, True, pipeline)
+                self.journal.pair_done(pair)
+                return True
+            if self.cancelled.is_set() or self.reachable(server):
+                # 已取消，或服务器正常、失败出在任务本身，换服务器也无济于事
+                self.release(server, False, pipeline)
+                return False
+            self.mark_down(server, pipeline)
+            tried.add(server.name)
+            self.log(f"⚠️ {server.name} 已掉线，{self.labels[tuple(pair)]} 转到其他服务器重跑")
+
+    def acquire(self, exclude=()):
+        """等待并占用负载最低、未满且健康的服务器；没有可用服务器时返回None"""
+        with self.condition:
+            while not self.cancelled.is_set():
+                now = time.monotonic()
+                candidates = [s for s in self.servers if s.name not in exclude and s.healthy(now)]
+                if not candidates:
+                    return None
+                free = [s for s in candidates if s.in_flight < s.max_jobs]
+                if free:
+                    known = [s.latency for s in self.servers if s.latency is not None]
+                    default = min(known) if known else 1.0
+                    server = min(free, key=lambda s: (s.load(default), s.in_flight))
+                    server.in_flight += 1
+                    return server
+                self.condition.wait(0.5)
+            return None
+
+    def cancel(self, grace=5, timeout=30, keep_pending=False):
+        """不再分发新的组，并行取消正在运行的各组，返回是否全部确认GPU已释放"""
+        self.keep_pending = keep_pending
+        self.cancelled.set()
+        with self.condition:
+            running = list(self.active)
+            self.condition.notify_all()
+        results = []
+        threads = [
+            threading.Thread(target=lambda p=p: results.append(p.cancel(grace, timeout, keep_pending)))
+            for p in running
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return all(results)
+
+    def release(self, server, ok, pipeline):
+        """一组结束：更新服务器负载与耗时估计，合并产物清单"""
+        with self.condition:
+            server.in_flight -= 1
+            if ok:
+                server.completed += 1
+            else:
+                server.failed += 1
+            for label, entry in pipeline.manifest.items():
+                self.manifest[label] = dict(entry, server=server.name)
+            self.settle_transfer(pipeline)
+            self.condition.notify_all()
+
+    def mark_down(self, server, pipeline):
+        """判定服务器掉线，冷却期内不再分配"""
+        shared_pool.discard(server.ssh_info)
+        with self.condition:
+            server.in_flight -= 1
+            server.failed += 1
+            server.down_until = time.monotonic() + self.cooldown
+            self.settle_transfer(pipeline)
+            self.condition.notify_all()
+
+    def settle_transfer(self, pipeline):
+        """结束的组不再计入速率，未传完的部分也不再计入总量"""
+        stats = self.transfers.get(id(pipeline.events))
+        if stats is not None:
+            self.transfers[id(pipeline.events)] = TransferStats(stats.done, stats.done, 0.0, 0.0, 0.0)
+
+    def reachable(self, server):
+        """服务器能否重新连上"""
+        try:
+            shared_pool.get(server.ssh_info)
+            return True
+        except Exception:
+            return False
+
+    def record_latency(self, server, seconds):
+        """记录一组的阶段耗时，更新该服务器每组耗时的平滑值"""
+        with self.condition:
+            server.latency = seconds if server.latency is None else (
+                self.smoothing * seconds + (1 - self.smoothing) * server.latency
+            )
+
+    def update_transfer(self, key, stats):
+        """汇总各组的传输进度后回报"""
+        with self.condition:
+            self.transfers[key] = stats
+            parts = list(self.transfers.values())
+        done = sum(s.done for s in parts)
+        total = sum(s.total for s in parts)
+        rate = sum(s.rate for s in parts)
+        elapsed = time.monotonic() - self.started
+        eta = (total - done) / rate if rate > 0 else -1.0
+        self.events.on_transfer(TransferStats(done, total, rate, done / elapsed if elapsed > 0 else 0.0, eta))
+
+    def log(self, message):
+        self.events.on_progress(message)
+
+    def write_manifest(self):
+        """记录每组源图片、产物与所在服务器的对应关系"""
+        merge_manifest(self.output_dir, self.manifest)
+
+
+class JobEvents(PipelineEvents):
+    """一组任务的回调：转发给上层，同时把阶段耗时与传输进度交给调度器"""
+
+    def __init__(self, dispatcher, server):
+        self.dispatcher = dispatcher
+        self.server = server
+        self.stage_seconds = 0.0
+
+    def on_progress(self, message):
+        self.dispatcher.events.on_progress(f"[{self.server.name}] {message}")
+
+    def on_intermediate(self, kind, source):
+        self.dispatcher.events.on_intermediate(kind, source)
+
+    def on_result(self, source):
+        self.dispatcher.events.on_result(source)
+
+    def on_stage_progress(self, stage, done, total):
+        self.dispatcher.events.on_stage_progress(stage, done, total)
+
+    def on_output(self, stage, line):
+        self.dispatcher.events.on_output(stage, f"[{self.server.name}] {line}")
+
+    def on_transfer(self, stats):
+        # 各组的TransferProgress相互独立，按回调对象区分
+        self.dispatcher.update_transfer(id(self), stats)
+
+    def on_span(self, span):
+        if span.stage in LOAD_STAGES:
+            self.stage_seconds += span.end - span.start
+        elif span.stage == "job" and span.ok and self.stage_seconds:
+            self.dispatcher.record_latency(self.server, self.stage_seconds)
+        self.dispatcher.events.on_span(span)
+
+
+# ============================================================
+#                        创建与恢复任务
+# ============================================================
+def create_pipeline(ssh_info, pairs, output_dir=None, pipelined=False, servers=None, **options):
+    """按参数创建流程：给出服务器列表时逐组分发，否则在单台服务器上顺序或流水线执行"""
+    if servers:
+        return Dispatcher(servers, pairs, output_dir, **options)
+    pipeline_cls = PipelinedFusion if pipelined else FusionPipeline
+    return pipeline_cls(ssh_info, pairs, output_dir, **options)
+
+
+def queue_job(job_queue, ssh_info, pairs, output_dir=None, pipelined=False, servers=None, **options):
+    """把create_pipeline的参数记入任务队列，返回交给流程的进度记录"""
+    if servers:
+        entries, mode = [dict(s.ssh_info, max_jobs=s.max_jobs) for s in servers], "dispatch"
+    else:
+        entries, mode = [ssh_info], "pipelined" if pipelined else "sequential"
+    stored = {name: options[name] for name in STORED_OPTIONS if name in options}
+    stored["cache"] = options.get("cache") is not None
+    return job_queue.journal(job_queue.add(entries, pairs, output_dir, mode, stored))
+
+
+def job_arguments(job, password_for, cache=None):
+    """由任务记录还原create_pipeline的参数（不含回调与运行日志）
+
+    password_for(服务器名) 返回该服务器的密码（队列中不保存密码），cache为任务启用缓存时使用的ResultCache。
+    """
+    infos = []
+    for entry in job.servers:
+        info = dict(entry)
+        max_jobs = info.pop("max_jobs", 1)
+        info["password"] = password_for(f"{info['hostname']}:{info['port']}")
+        infos.append((info, max_jobs))
+    options = dict(job.options)
+    options["cache"] = cache if options.pop("cache", False) else None
+    # 名称按任务的全部组计算，与第一次运行时一致
+    arguments = dict(options, pairs=remaining_pairs(job), output_dir=job.output_dir, labels=pair_labels(job.pairs))
+    if job.mode == "dispatch":
+        return dict(arguments, ssh_info=None, servers=[ServerState(info, max_jobs) for info, max_jobs in infos])
+    return dict(arguments, ssh_info=infos[0][0], pipelined=job.mode == "pipelined")
@@ -0,0 +1,350 @@
+"""本地模拟的UDIS2 GPU服务器，用于在没有租用服务器时调试与基准测试
+
+基于paramiko的ServerInterface实现SSH exec与SFTP，在root目录下模拟服务器家目录：
+    autodl-tmp/UDIS-D/testing/...、autodl-tmp/UDIS2-main/Warp|Composition/...
+阶段脚本 test_output.py、test.py 为桩程序，按配置的耗时逐组生成假的变形、掩码与融合图片。
+可注入网络往返延迟与带宽限制。
+
+用法:
+    python fake_server.py --port 2222 --latency 80 --bandwidth 2048 --stage-delay 0.5
+任何用户名与密码都可登录。
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import paramiko
+from remote_layout import REMOTE_PYTHON, UDIS2_DIR, WARP_STAGE, COMPOSITION_STAGE
+
+CONFIG_NAME = "fake_udis.json"
+
+# 阶段桩程序：逐组读取 --test_path 下的输入，等待stage_delay秒后把输入复制为各产物，并按output_bytes补齐大小；
+# 与UDIS2脚本一样，变形产物写到 --test_path 下，合成产物写到工作目录的上一级
+STUB_TEMPLATE = '''import os, sys, json, time
+home = os.path.expanduser("~")
+config = json.load(open(os.path.join(home, "{config}")))
+inputs = sys.argv[sys.argv.index("--test_path") + 1]
+names = sorted(os.listdir(os.path.join(inputs, "input1")))
+for i, name in enumerate(names, start=1):
+    time.sleep(config["stage_delay"])
+    for kind, source in {outputs}:
+        with open(os.path.join(inputs, source, name), "rb") as f:
+            data = f.read()
+        # JPEG解码器忽略EOI之后的数据，用随机字节补齐到指定大小
+        data += os.urandom(max(0, config["output_bytes"] - len(data)))
+        target = os.path.join({target}, kind, name)
+        with open(target + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(target + ".tmp", target)
+    print(f"{{i}}/{{len(names)}}", flush=True)
+'''
+
+WARP_OUTPUTS = [("warp1", "input1"), ("warp2", "input2"), ("mask1", "input1"), ("mask2", "input2")]
+COMPOSITION_OUTPUTS = [("learn_mask1", "input1"), ("learn_mask2", "input2"), ("composition", "input1")]
+
+
+def build_layout(root, stage_delay=0.5, output_bytes=0):
+    """在root下建立模拟的服务器目录结构与阶段桩程序"""
+    stages = [(WARP_STAGE, WARP_OUTPUTS, "inputs"), (COMPOSITION_STAGE, COMPOSITION_OUTPUTS, "os.pardir")]
+    for stage, outputs, target in stages:
+        script = os.path.join(root, stage.script)
+        os.makedirs(os.path.dirname(script), exist_ok=True)
+        with open(script, "w") as f:
+            f.write(STUB_TEMPLATE.format(config=CONFIG_NAME, outputs=repr(outputs), target=target))
+    # 模型指纹命令会统计权重文件
+    for model_dir in ["Warp/model", "Composition/model"]:
+        os.makedirs(os.path.join(root, UDIS2_DIR, model_dir), exist_ok=True)
+        with open(os.path.join(root, UDIS2_DIR, model_dir, "epoch050_model.pth"), "wb") as f:
+            f.write(b"fake weights")
+    configure(root, stage_delay, output_bytes)
+
+
+def configure(root, stage_delay, output_bytes):
+    """修改桩程序的每组耗时与产物大小"""
+    with open(os.path.join(root, CONFIG_NAME), "w") as f:
+        json.dump({"stage_delay": stage_delay, "output_bytes": output_bytes}, f)
+
+
+# ============================================================
+#                        网络延迟与带宽模拟
+# ============================================================
+class LinkShaper:
+    """在客户端连接与SSH服务之间转发数据，两个方向各加上一半往返延迟并按带宽限速
+
+    数据按到达时间排队，延迟不会降低吞吐，与真实链路的带宽时延积行为一致。
+    """
+
+    def __init__(self, latency=0.0, bandwidth=0):
+        self.delay = latency / 2  # 单向延迟（秒）
+        self.bandwidth = bandwidth  # 每个方向的带宽（字节/秒），0表示不限
+
+    def wrap(self, client):
+        """返回交给paramiko的一端，另一端与client之间由转发线程连接"""
+        if not self.delay and not self.bandwidth:
+            return client
+        inner, outer = socket.socketpair()
+        for source, target in [(client, outer), (outer, client)]:
+            threading.Thread(target=self.forward, args=(source, target), daemon=True).start()
+        return inner
+
+    def forward(self, source, target):
+        """单向转发：读取端把数据标上送达时间放入队列，发送端按时间与带宽发出"""
+        pending = []
+        condition = threading.Condition()
+        closed = []
+
+        def reader():
+            sequence = 0
+            try:
+                for chunk in iter(lambda: source.recv(65536), b""):
+                    with condition:
+                        heapq.heappush(pending, (time.monotonic() + self.delay, sequence, chunk))
+                        sequence += 1
+                        condition.notify()
+            except OSError:
+                pass
+            with condition:
+                closed.append(True)
+                condition.notify()
+
+        threading.Thread(target=reader, daemon=True).start()
+        next_free = time.monotonic()
+        try:
+            while True:
+                with condition:
+                    while not pending and not closed:
+                        condition.wait()
+                    if not pending:
+                        break
+                    due, _, chunk = heapq.heappop(pending)
+                now = time.monotonic()
+                start = max(due, next_free)
+                if start > now:
+                    time.sleep(start - now)
+                if self.bandwidth:
+                    next_free = max(start, next_free) + len(chunk) / self.bandwidth
+                target.sendall(chunk)
+        except OSError:
+            pass
+        finally:
+            try:
+                target.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+
+# ============================================================
+#                        SFTP
+# ============================================================
+class FakeSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        return paramiko.sftp.SFTP_OK
+
+
+class FakeSFTPServer(paramiko.SFTPServerInterface):
+    """把SFTP路径映射到root目录，相对路径相对家目录（root）"""
+
+    root = None
+
+    def local(self, path):
+        return self.root + self.canonicalize(path)
+
+    def canonicalize(self, path):
+        if not path.startswith("/"):
+            path = "/" + path
+        return os.path.normpath(path).replace("//", "/")
+
+    def list_folder(self, path):
+        try:
+            folder = self.local(path)
+            result = []
+            for name in os.listdir(folder):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(folder, name)))
+                attr.filename = name
+                result.append(attr)
+            return result
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(self.local(path), flags, 0o666)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = FakeSFTPHandle(flags)
+        handle.filename = self.local(path)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        return self.call(os.remove, self.local(path))
+
+    def rename(self, old, new):
+        return self.call(os.rename, self.local(old), self.local(new))
+
+    posix_rename = rename
+
+    def mkdir(self, path, attr):
+        return self.call(os.mkdir, self.local(path))
+
+    def rmdir(self, path):
+        return self.call(os.rmdir, self.local(path))
+
+    def chattr(self, path, attr):
+        return paramiko.sftp.SFTP_OK
+
+    @staticmethod
+    def call(func, *args):
+        try:
+            func(*args)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.sftp.SFTP_OK
+
+
+# ============================================================
+#                        SSH
+# ============================================================
+class FakeSSHServer(paramiko.ServerInterface):
+    """接受任意密码，exec请求在root下用bash执行（HOME指向root）"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode().replace(REMOTE_PYTHON, sys.executable)
+        threading.Thread(target=self.execute, args=(channel, command), daemon=True).start()
+        return True
+
+    def execute(self, channel, command):
+        """执行命令，转发stdin/stdout/stderr并返回退出码"""
+        process = subprocess.Popen(
+            ["bash", "-c", command], cwd=self.root, env=dict(os.environ, HOME=self.root),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+        def pump(source, send):
+            for chunk in iter(lambda: source.read1(32768), b""):
+                send(chunk)
+
+        def feed():
+            try:
+                for data in iter(lambda: channel.recv(32768), b""):
+                    process.stdin.write(data)
+                    process.stdin.flush()
+            except Exception:
+                pass
+            try:
+                process.stdin.close()
+            except Exception:
+                pass
+
+        threading.Thread(target=feed, daemon=True).start()
+        stderr = threading.Thread(target=pump, args=(process.stderr, channel.sendall_stderr))
+        stderr.start()
+        try:
+            pump(process.stdout, channel.sendall)
+        except Exception:
+            # 客户端关闭了通道（例如停止监视），结束对应进程
+            process.kill()
+        stderr.join()
+        code = process.wait()
+        # 被信号终止时returncode为负数，与shell一样报告为128+信号值
+        channel.send_exit_status(code if code >= 0 else 128 - code)
+        channel.close()
+
+
+class FakeServer:
+    """在后台线程中监听端口的模拟服务器"""
+
+    def __init__(self, root, port=0, latency=0.0, bandwidth=0):
+        self.root = os.path.abspath(root)
+        self.shaper = LinkShaper(latency, bandwidth)
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sftp_class = type("RootedSFTPServer", (FakeSFTPServer,), {"root": self.root})
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", port))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+
+    def start(self):
+        threading.Thread(target=self.serve, daemon=True).start()
+        return self
+
+    def serve(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(client,), daemon=True).start()
+
+    def handle(self, client):
+        transport = paramiko.Transport(self.shaper.wrap(client))
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, self.sftp_class)
+        transport.start_server(server=FakeSSHServer(self.root))
+
+    def close(self):
+        self.listener.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟的UDIS2 GPU服务器")
+    parser.add_argument("--root", help="模拟的家目录（默认新建临时目录）")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--latency", type=float, default=0, help="往返延迟（毫秒）")
+    parser.add_argument("--bandwidth", type=float, default=0, help="每个方向的带宽（KB/s），0表示不限")
+    parser.add_argument("--stage-delay", type=float, default=0.5, help="每个阶段处理一组图片的耗时（秒）")
+    parser.add_argument("--output-bytes", type=int, default=0, help="每个产物补齐到的字节数，0表示与输入相同")
+    args = parser.parse_args(argv)
+
+    root = args.root or tempfile.mkdtemp(prefix="fake_udis_")
+    build_layout(root, args.stage_delay, args.output_bytes)
+    server = FakeServer(root, args.port, args.latency / 1000, args.bandwidth * 1024).start()
+    print(f"模拟服务器已启动: 127.0.0.1:{server.port}  家目录 {root}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""UDIS2 图像融合命令行工具（不依赖Qt，适合在无界面的机器上批量运行）
+
+用法示例:
+    python -m fusion_cli --host connect.cqa1.seetacloud.com --port 18863 a.jpg b.jpg
+    python -m fusion_cli --host ... --port ... --pipeline --output out/ folder1 folder2
+    python -m fusion_cli --servers servers.json --output out/ folder1
+    python -m fusion_cli --host ... --port ... --from-stage composition a.jpg b.jpg
+    python -m fusion_cli --resume
+
+
+参数可以是成对的图片文件，也可以是包含input1/、input2/子目录的文件夹（同名文件组成一组）。
+密码通过 --password、环境变量 UDIS_PASSWORD 或交互输入提供。
+--servers 给出服务器列表JSON时，每组分发到负载最低的可用服务器，列表中未写密码的服务器使用上述密码：
+    [{"hostname": "connect.cqa1.seetacloud.com", "port": 18863, "max_jobs": 1}, ...]
+每个任务都记入本地任务队列，程序中途退出后可用 --resume 从上次完成的步骤继续。
+"""
+import os
+import sys
+import time
+import getpass
+import argparse
+from fusion_pipeline import PipelineEvents, collect_pairs
+from result_cache import ResultCache
+from transfer import format_size
+from telemetry import DEFAULT_RUN_LOG, RunLog
+from dispatcher import load_roster, create_pipeline, queue_job, job_arguments
+from job_queue import JobQueue, STAGES, remaining_pairs
+
+DEFAULT_OUTPUT_DIR = "udis_output"
+
+
+# ============================================================
+#                        终端输出
+# ============================================================
+class ConsoleEvents(PipelineEvents):
+    """把流程回调打印到终端"""
+
+    def __init__(self, show_transfer=False):
+        self.show_transfer = show_transfer
+
+    def on_progress(self, message):
+        self.clear_line()
+        print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+
+    def on_result(self, source):
+        self.on_progress(f"结果: {source}")
+
+    def on_transfer(self, stats):
+        if not self.show_transfer:
+            return
+        text = f"{format_size(stats.done)} / {format_size(stats.total)}  {format_size(stats.rate)}/s"
+        if stats.eta >= 0:
+            text += f"  剩余 {stats.eta:.0f} 秒"
+        sys.stderr.write(f"\r{text:<60}")
+        sys.stderr.flush()
+
+    def on_stage_progress(self, stage, done, total):
+        if not self.show_transfer:
+            return
+        sys.stderr.write(f"\r{f'{stage} {done}/{total}':<60}")
+        sys.stderr.flush()
+
+    def clear_line(self):
+        """清掉传输进度行"""
+        if self.show_transfer:
+            sys.stderr.write("\r" + " " * 60 + "\r")
+
+
+def parse_pairs(inputs):
+    """把命令行参数解析为 [(input1路径, input2路径), ...]"""
+    pairs = []
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            found = collect_pairs(item)
+            if not found:
+                raise ValueError(f"{item} 中没有input1与input2同名的图片")
+            pairs.extend(found)
+        else:
+            files.append(item)
+    if len(files) % 2:
+        raise ValueError("图片文件需成对给出")
+    pairs.extend(zip(files[0::2], files[1::2]))
+    if not pairs:
+        raise ValueError("没有需要处理的图片")
+    return pairs
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m fusion_cli", description="UDIS2 图像融合")
+    parser.add_argument("inputs", nargs="*", help="成对的图片文件，或包含input1/input2子目录的文件夹")
+    parser.add_argument("--host", help="服务器地址")
+    parser.add_argument("--servers", help="服务器列表JSON文件，给出时逐组分发到各服务器，忽略--host/--port")
+    parser.add_argument("--port", type=int, default=22, help="SSH端口")
+    parser.add_argument("--user", default="root", help="用户名")
+    parser.add_argument("--password", help="密码（默认读取环境变量UDIS_PASSWORD或交互输入）")
+    parser.add_argument("--output", help=f"产物保存目录（默认 {DEFAULT_OUTPUT_DIR}/<时间>）")
+    parser.add_argument("--pipeline", action="store_true", help="流水线模式：上传、计算、下载重叠执行")
+    parser.add_argument("--worker", action="store_true", help="使用服务器上的常驻推理进程")
+    parser.add_argument("--no-cache", action="store_true", help="不使用本地结果缓存")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发传输数")
+    parser.add_argument("--max-size", type=int, help="上传前把图片缩小到该最长边并重新编码")
+    parser.add_argument("--quality", type=int, default=90, help="重新编码的JPEG质量")
+    parser.add_argument("--bundle", choices=["auto", "always", "never"], default="auto", help="产物打包下载")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], help="打包下载时的压缩方式")
+    parser.add_argument("--from-stage", choices=STAGES, default="upload",
+                        help="从该步骤开始执行，之前的步骤复用服务器上仍然有效的结果（例如只重跑合成）")
+    parser.add_argument("--resume", action="store_true",
+                        help="继续任务队列中未完成的任务，只使用密码、--servers（取其中的密码）与--run-log")
+    parser.add_argument("--run-log", default=DEFAULT_RUN_LOG, help="步骤耗时记录（JSONL）的保存路径，空字符串表示不记录")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.resume:
+        return resume_jobs(args)
+    if not (args.host or args.servers):
+        parser.error("需要 --host 或 --servers")
+    if args.pipeline and args.from_stage != "upload":
+        parser.error("流水线模式不支持 --from-stage")
+    try:
+        pairs = parse_pairs(args.inputs)
+        servers = load_roster(args.servers) if args.servers else None
+    except (ValueError, OSError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+    password = None
+    if servers is None or any("password" not in server.ssh_info for server in servers):
+        password = read_password(args)
+    for server in servers or []:
+        server.ssh_info.setdefault("password", password)
+    ssh_info = {"hostname": args.host, "port": args.port, "username": args.user, "password": password}
+    output_dir = args.output or os.path.join(DEFAULT_OUTPUT_DIR, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    options = dict(
+        cache=None if args.no_cache else ResultCache(),
+        use_worker=args.worker,
+        concurrency=args.concurrency,
+        preprocess={"max_size": args.max_size, "quality": args.quality} if args.max_size else None,
+        bundle=args.bundle,
+        compression=args.compression,
+        start_stage=args.from_stage
+    )
+    # 先打开运行日志，出错时任务还没有入队，不会留下无法完成的任务
+    run_log = RunLog(args.run_log) if args.run_log else None
+    journal = queue_job(JobQueue(), ssh_info, pairs, output_dir, args.pipeline, servers, **options)
+    pipeline = create_pipeline(
+        ssh_info, pairs, output_dir, args.pipeline, servers,
+        events=ConsoleEvents(show_transfer=sys.stderr.isatty()),
+        run_log=run_log, journal=journal, **options
+    )
+    print(f"任务 {journal.job_id}：处理 {len(pairs)} 组图片，结果保存到 {output_dir}", flush=True)
+    ok = pipeline.run()
+    return 0 if ok else 1
+
+
+def read_password(args):
+    """密码：--password、环境变量UDIS_PASSWORD或交互输入"""
+    return args.password or os.environ.get("UDIS_PASSWORD") or getpass.getpass("服务器密码: ")
+
+
+def resume_jobs(args):
+    """依次继续任务队列中未完成的任务，全部成功时返回0"""
+    job_queue = JobQueue()
+    jobs = job_queue.pending()
+    if not jobs:
+        print("没有未完成的任务")
+        return 0
+    # 队列中不保存密码：优先取 --servers 列表中写明的，其余服务器共用一个密码
+    passwords = {
+        server.name: server.ssh_info["password"]
+        for server in (load_roster(args.servers) if args.servers else []) if "password" in server.ssh_info
+    }
+
+    def password_for(name):
+        if name not in passwords:
+            passwords[name] = passwords.get(None) or read_password(args)
+            passwords[None] = passwords[name]
+        return passwords[name]
+
+    ok = True
+    for job in jobs:
+        if not job_queue.claim(job.job_id):
+            print(f"任务 {job.job_id} 已由其他进程继续执行，跳过", flush=True)
+            continue
+        if not remaining_pairs(job):
+            job_queue.update(job.job_id, status="done")
+            continue
+        arguments = job_arguments(job, password_for, ResultCache())
+        print(f"继续任务 {job.job_id}（{job.mode}，上次完成: {job.stage or '无'}），"
+              f"{len(arguments['pairs'])} 组图片，结果保存到 {job.output_dir}", flush=True)
+        pipeline = create_pipeline(
+            events=ConsoleEvents(show_transfer=sys.stderr.isatty()),
+            run_log=RunLog(args.run_log) if args.run_log else None,
+            journal=job_queue.journal(job.job_id), **arguments
+        )
+        ok = pipeline.run() and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
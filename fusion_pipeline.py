@@ -0,0 +1,1042 @@
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import queue
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from ssh_pool import shared_pool
+from upload_store import ContentStore, file_digest
+from preprocess import prepare_upload
+from result_cache import ResultCache
+from transfer import TransferEngine, TransferProgress
+from remote_watch import RemoteWatcher
+from remote_stream import stream_command, read_command, parse_progress
+from telemetry import Span
+from job_queue import JobJournal, STAGES
+from remote_worker import WorkerError, get_worker, discard_worker
+from remote_layout import (
+    ARTIFACT_DIRS, WARP_ARTIFACTS, COMPOSITION_ARTIFACTS,
+    FETCHED_ARTIFACTS, WARP_STAGE, COMPOSITION_STAGE, FINGERPRINT_COMMAND,
+    STAGING_DIR, RESULTS_DIR, CHECKPOINT_STAGES, Workspace,
+    stage_fingerprint_command, collect_workspaces_command, pair_name,
+    WORKER_PID_NAME, GPU_APPS_COMMAND, kill_group_command, mark_cancelled_command, cancel_path
+)
+
+# 各步骤在服务器上的产物，恢复任务时据此确认检查点仍然有效
+STAGE_OUTPUTS = {"warp": WARP_ARTIFACTS, "composition": COMPOSITION_ARTIFACTS}
+
+# 同一进程中的多个流程（例如分发的各组）写同一个manifest.json时依次合并
+_manifest_lock = threading.Lock()
+
+# 本进程中已清理过过期工作空间的服务器，每台服务器只在首次连接时清理一次
+_collected = set()
+_collected_lock = threading.Lock()
+
+
+# ============================================================
+#                        流程事件
+# ============================================================
+class PipelineEvents:
+    """流程回调接口，按需覆盖；回调可能来自传输线程，界面程序需自行转到界面线程"""
+
+    def on_progress(self, message):
+        """一条进度信息"""
+
+    def on_intermediate(self, kind, source):
+        """中间产物可用，source为本地路径或（内存模式下）图片内容bytes"""
+
+    def on_result(self, source):
+        """一组的最终结果可用，source同上"""
+
+    def on_transfer(self, stats):
+        """传输字节进度（TransferStats）"""
+
+    def on_span(self, span):
+        """一个步骤结束（telemetry.Span）"""
+
+    def on_stage_progress(self, stage, done, total):
+        """阶段脚本输出的进度行（例如 "3/10"）"""
+
+    def on_output(self, stage, line):
+        """阶段脚本的一行原始输出，默认当作一条进度信息"""
+        self.on_progress(line)
+
+
+# ============================================================
+#                        融合流程
+# ============================================================
+class FusionPipeline:
+    """上传、变形、融合、下载的完整流程，不依赖Qt
+
+    run() 在调用线程中同步执行并返回是否成功，过程通过events（PipelineEvents）回调报告。
+    服务器上的文件都在以任务ID命名的工作空间中，同一台服务器上的多个任务互不干扰。
+    """
+
+    # 任务结束后保留工作空间，供恢复与单独重跑某一步骤复用，过期后由后台清理
+    KEEP_WORKSPACE = True
+
+    def __init__(self, ssh_info, pairs, output_dir=None, cache=None, use_worker=False, concurrency=4,
+                 preprocess=None, bundle="auto", compression=None, events=None, run_log=None, journal=None,
+                 start_stage="upload", keep_workspace=None, labels=None):
+        self.events = events or PipelineEvents()
+        self.run_log = run_log  # 步骤耗时记录写入的RunLog，None表示不记录
+        self.journal = journal or JobJournal()  # 任务队列中的进度记录，不入队时什么也不记
+        self.job_id = self.journal.job_id or uuid.uuid4().hex[:12]
+        self.workspace = Workspace(self.job_id)  # 恢复的任务沿用原来的工作空间
+        self.keep_workspace = self.KEEP_WORKSPACE if keep_workspace is None else keep_workspace
+        self.current_span = threading.local()  # 各线程当前所在步骤，服务器命令的退出码记入其中
+        self.job_span = None  # 整个任务的步骤记录，没有所在步骤的线程（例如流水线的各阶段线程）以它为上级
+        self.span_lock = threading.Lock()
+        self.ssh_info = ssh_info
+        self.pairs = pairs  # [(input1路径, input2路径), ...]，按顺序编号为000001..N
+        # 各组的名称，用作本地产物目录与清单的键；由上层给出时沿用（分发与恢复时各组名称不变）
+        self.labels = labels or pair_labels(pairs)
+        self.output_dir = output_dir  # 产物的本地保存目录，None表示只在内存中传递，不写磁盘
+        self.cache = cache  # 本地结果缓存，None表示不使用
+        self.use_worker = use_worker  # 是否使用服务器上的常驻推理进程
+        self.concurrency = concurrency  # 同时进行的文件传输数
+        self.preprocess = preprocess  # 上传前压缩参数 {"max_size": 最长边, "quality": JPEG质量}，None表示不压缩
+        self.bundle = bundle  # 产物打包下载："auto"按链路自动选择，"always"总是打包，"never"逐个文件下载
+        self.compression = compression  # 打包下载时的压缩方式：None、"gzip"、"zstd"
+        # 顺序模式下从哪个步骤开始执行，之前的步骤复用服务器上仍然有效的结果（例如只重跑合成）
+        self.start_stage = start_stage
+        self.worker = None
+        self.fingerprint = None
+        self.manifest = {}
+        self.artifacts = {}  # 内存模式下已下载的产物 {(组序号, 产物名): 图片内容}
+        self.ssh = None
+        self.sftp = None
+        self.transfers = None
+        self.cancelled = threading.Event()  # cancel()后置位，各步骤之间检查
+        self.keep_pending = False  # 取消后任务仍留在队列中，下次启动时可以继续
+        # 本次任务全部上传与下载的字节进度，限频回调events.on_transfer
+        self.transfer_progress = TransferProgress(self.events.on_transfer)
+
+    def run(self):
+        """执行全部步骤，返回是否成功"""
+        self.journal.running()
+        with self.span("job") as job:
+            self.job_span = job
+            job["ok"] = self.run_steps()
+        if not (self.cancelled.is_set() and self.keep_pending):
+            self.journal.finish(job["ok"], "已取消" if self.cancelled.is_set() else None)
+        return job["ok"]
+
+    def run_steps(self):
+        try:
+            # 命中本地缓存的组直接返回结果
+            with self.span("cache"):
+                if self.serve_cached():
+                    return True
+
+            # 连接服务器
+            self.ssh = self.step("connect", self.connect_ssh)
+            if not self.ssh:
+                return False
+
+            # 上传图片、处理变形与融合并获取中间产物、下载最终结果；
+            # 指定起始步骤或恢复任务时，跳过服务器上结果仍然有效的步骤
+            steps = [
+                ("upload", self.upload_images),
+                ("warp", self.process_warp),
+                ("composition", self.process_composition),
+                ("download", self.download_result),
+            ]
+            skip = self.resume_point()
+            if skip:
+                # 单独重跑某一步骤时界面上已有之前的中间产物，内存模式下不再重新下载；
+                # 使用本地缓存时仍需下载，缓存条目要包含全部产物
+                self.restore_intermediates(
+                    [stage for stage, _ in steps[:skip]],
+                    fetch=self.output_dir is not None or self.journal.stage is not None or self.cache is not None
+                )
+            for stage, func in steps[skip:]:
+                if self.cancelled.is_set() or not self.step(stage, func):
+                    return False
+                self.checkpoint(stage)
+            return True
+
+        except Exception as e:
+            self.log(f"❌ 发生错误: {str(e)}")
+            return False
+        finally:
+            self.remove_workspace()
+            self.release()
+
+    @contextmanager
+    def span(self, stage, index=None):
+        """记录一个步骤的耗时与块内发起的传输的字节数，结束时回调events.on_span并写入运行日志
+
+        块内可通过 record["ok"] 标记步骤失败，块内执行的服务器命令的退出码自动记入。
+        字节数只计块内发起的传输（包括交给传输线程的），同时计入各上级步骤，其他线程同时进行的传输不计入。
+        """
+        parent = self.current_record()
+        record = {"exit_status": None, "ok": True, "bytes": 0, "parent": parent}
+        self.current_span.record = record
+        start = time.monotonic()
+        try:
+            yield record
+        except Exception:
+            record["ok"] = False
+            raise
+        finally:
+            self.current_span.record = parent
+            span = Span(
+                self.job_id, stage, index, start, time.monotonic(),
+                record["bytes"], record["exit_status"], record["ok"], self.server_id()
+            )
+            self.events.on_span(span)
+            if self.run_log is not None:
+                self.run_log.append(span)
+
+    def step(self, stage, func):
+        """在span中执行一个返回成功与否（或连接）的步骤"""
+        with self.span(stage) as record:
+            result = func()
+            record["ok"] = bool(result)
+        return result
+
+    def record_exit(self, code):
+        """把服务器命令的退出码记入当前步骤"""
+        record = getattr(self.current_span, "record", None)
+        if record is not None:
+            record["exit_status"] = code
+
+    def current_record(self):
+        """当前线程所在步骤的记录，不在任何步骤中时为整个任务的记录（任务开始前为None）"""
+        return getattr(self.current_span, "record", None) or self.job_span
+
+    def in_current_span(self, func):
+        """包装func，使其在传输线程中执行时仍归属于调用本方法时所在的步骤"""
+        record = self.current_record()
+
+        def call(*args):
+            previous = getattr(self.current_span, "record", None)
+            self.current_span.record = record
+            try:
+                return func(*args)
+            finally:
+                self.current_span.record = previous
+        return call
+
+    def transfer_callback(self, key):
+        """文件key的字节进度回调：计入任务的传输进度，同时计入当前步骤及其各上级步骤"""
+        progress = self.transfer_progress.callback(key)
+        record = self.current_record()
+        if record is None:
+            return progress
+        counted = [0]
+
+        def callback(transferred, total):
+            with self.span_lock:
+                delta, counted[0] = transferred - counted[0], transferred
+                span = record
+                while span is not None:
+                    span["bytes"] += delta
+                    span = span["parent"]
+            progress(transferred, total)
+        return callback
+
+    def inputs_digest(self):
+        """本次各组输入内容与压缩参数的摘要，输入有变化时检查点作废"""
+        digest = hashlib.sha256(json.dumps(self.preprocess, sort_keys=True).encode())
+        for pair in self.pairs:
+            for path in pair:
+                digest.update(file_digest(path).encode())
+        return digest.hexdigest()[:16]
+
+    def checkpoint(self, stage):
+        """一个步骤完成：在服务器上留下检查点（输入摘要与该步骤的模型指纹），并写入任务队列"""
+        if stage in CHECKPOINT_STAGES:
+            self.run_command(
+                f"echo \"{self.inputs_digest()} $({stage_fingerprint_command(stage)})\""
+                f" > ~/{self.workspace.checkpoint_path(stage)} && touch ~/{self.workspace.root}/.lease"
+            )
+        self.journal.stage_done(stage)
+
+    def checkpoint_status(self):
+        """各步骤检查点是否有效 [是否有效, ...]，与CHECKPOINT_STAGES一一对应
+
+        一次往返读出检查点、当前模型指纹与缺失的产物数；输入或模型变了、产物不全的步骤无效。
+        """
+        commands = []
+        for stage in CHECKPOINT_STAGES:
+            commands.append(f"cat ~/{self.workspace.checkpoint_path(stage)} 2>/dev/null || echo")
+            commands.append(stage_fingerprint_command(stage))
+            paths = " ".join(f"~/{path}" for path in self.stage_outputs(stage))
+            commands.append(f"n=0; for f in {paths}; do [ -f $f ] || n=$((n+1)); done; echo $n")
+        lines = self.run_command("; ".join(commands)).splitlines()
+        digest = self.inputs_digest()
+        return [
+            saved.strip() == f"{digest} {fingerprint.strip()}" and missing.strip() == "0"
+            for saved, fingerprint, missing in zip(lines[0::3], lines[1::3], lines[2::3])
+        ]
+
+    def stage_outputs(self, stage):
+        """步骤完成后服务器上应有的文件"""
+        indexes = range(1, len(self.pairs) + 1)
+        if stage == "upload":
+            return [self.workspace.input_path(slot, index) for index in indexes for slot in (1, 2)]
+        return [self.workspace.artifact_path(kind, index) for index in indexes for kind in STAGE_OUTPUTS[stage]]
+
+    def resume_point(self):
+        """可以跳过的步骤数：从start_stage开始执行，恢复的任务还可跳过上次已完成的步骤
+
+        只有从第一步起连续有效的检查点才能跳过；下载步骤总是重新执行。
+        """
+        wanted = STAGES.index(self.start_stage)
+        if self.journal.stage in STAGES:
+            wanted = max(wanted, STAGES.index(self.journal.stage) + 1)
+        wanted = min(wanted, len(CHECKPOINT_STAGES))
+        if wanted == 0:
+            return 0
+        # 新任务的工作空间是空的，先从最近一个输入相同的任务的工作空间复制结果
+        source = self.run_command(self.workspace.seed_command(self.inputs_digest())).strip()
+        if source:
+            self.log(f"♻️ 从任务 {os.path.basename(source)} 的工作空间复制已有结果")
+        skip = 0
+        for valid in self.checkpoint_status()[:wanted]:
+            if not valid:
+                break
+            skip += 1
+        if skip:
+            self.log(f"♻️ 复用服务器上已有的结果，跳过: {', '.join(CHECKPOINT_STAGES[:skip])}")
+        if skip < wanted:
+            self.log(f"⚠️ 服务器上的{CHECKPOINT_STAGES[skip]}结果已失效，从该步骤开始")
+        return skip
+
+    def restore_intermediates(self, stages, fetch=True):
+        """跳过的步骤的中间产物：本地已有的直接显示，其余在fetch为True时重新下载"""
+        files = []
+        for stage in stages:
+            kinds = [kind for kind in STAGE_OUTPUTS.get(stage, []) if kind != "composition"]
+            for index in range(1, len(self.pairs) + 1):
+                for kind in kinds:
+                    path = self.local_path(kind, index)
+                    if path is not None and os.path.exists(path):
+                        self.events.on_intermediate(kind, path)
+                    else:
+                        files.append((index, kind))
+        if files and fetch:
+            self.fetch_artifacts(files, self.intermediate_done)
+
+    def log(self, message):
+        """报告一条进度信息"""
+        self.events.on_progress(message)
+
+    def cancel(self, grace=5, timeout=30, keep_pending=False):
+        """取消任务：终止服务器上正在运行的阶段进程组并等待GPU释放，返回是否确认GPU已释放
+
+        可在任意线程调用。通过新的通道发送信号，先SIGTERM、grace秒后SIGKILL，
+        阻塞中的阶段命令随之以非零状态返回，run() 在当前步骤结束后返回False。
+        keep_pending为True时（例如关闭窗口）任务留在队列中，下次启动时从已完成的步骤继续。
+        """
+        self.keep_pending = keep_pending
+        self.cancelled.set()
+        self.log("正在取消，终止服务器上的进程...")
+        try:
+            ssh = shared_pool.get(self.ssh_info)
+            # 常驻进程由同一服务器上的任务共用，只在它正执行本任务的请求时才终止
+            worker = self.worker
+            kill_worker = worker is not None and worker.owner == self.job_id
+            names = [self.job_id] + ([WORKER_PID_NAME] if kill_worker else [])
+            pids = []
+            for name in names:
+                command = kill_group_command(name, grace)
+                if name == self.job_id:
+                    # 先写取消标记，此时尚未启动的阶段进程不会再运行
+                    command = f"{mark_cancelled_command(name)}; {command}"
+                _, stdout, _ = ssh.exec_command(command)
+                pids += stdout.read().decode().split()
+            if kill_worker:
+                discard_worker(shared_pool.key(self.ssh_info))
+            released = self.wait_gpu_released(ssh, pids, timeout)
+        except Exception as e:
+            self.log(f"❌ 取消失败: {str(e)}")
+            return False
+        self.log("✅ 已取消，GPU已释放" if released else "⚠️ 已取消，但未能确认GPU已释放")
+        return released
+
+    def wait_gpu_released(self, ssh, pids, timeout):
+        """等待被终止的进程全部退出且不再出现在nvidia-smi的计算进程列表中"""
+        if not pids:
+            return True
+        check = f"{GPU_APPS_COMMAND}; for p in {' '.join(pids)}; do kill -0 $p 2>/dev/null && echo $p; done"
+        deadline = time.monotonic() + timeout
+        while True:
+            _, stdout, _ = ssh.exec_command(check)
+            if not set(stdout.read().decode().split()) & set(pids):
+                return True
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.5)
+
+    def release(self):
+        """连接归还连接池，只关闭本任务的SFTP通道"""
+        if self.transfers:
+            self.transfers.close()
+        if self.sftp:
+            self.sftp.close()
+
+    def connect_ssh(self):
+        """从连接池获取SSH连接"""
+        try:
+            reused = shared_pool.has_live(self.ssh_info)
+            ssh = shared_pool.get(self.ssh_info)
+            self.sftp = ssh.open_sftp()
+            self.transfers = TransferEngine(ssh, self.concurrency)
+            self.log("✅ 复用已有服务器连接" if reused else "✅ 服务器连接成功")
+            # 同一任务上次取消留下的标记已不再适用（恢复的任务沿用原来的任务ID）；
+            # 上次运行中途退出时服务器上的阶段进程不会随之退出，先终止，免得与本次运行同时写工作空间
+            code, output, errors = read_command(
+                ssh,
+                f"{self.workspace.create_command()} && rm -f ~/{cancel_path(self.job_id)} && "
+                f"{kill_group_command(self.job_id)}"
+            )
+            if code != 0:
+                raise Exception(f"创建工作空间失败: {errors}")
+            if output.split():
+                self.log("⚠️ 已终止上次运行遗留在服务器上的进程")
+                if not self.wait_gpu_released(ssh, output.split(), 30):
+                    self.log("⚠️ 未能确认GPU已释放")
+            self.collect_workspaces()
+            if self.cache is not None:
+                self.refresh_fingerprint(ssh)
+            if self.use_worker:
+                self.start_worker(ssh)
+            return ssh
+        except Exception as e:
+            self.log(f"❌ 连接失败: {str(e)}")
+            return None
+
+    def collect_workspaces(self):
+        """在后台清理服务器上过期的工作空间，每个进程对每台服务器只做一次"""
+        key = shared_pool.key(self.ssh_info)
+        with _collected_lock:
+            if key in _collected:
+                return
+            _collected.add(key)
+
+        def collect():
+            try:
+                code, output, _ = read_command(shared_pool.get(self.ssh_info), collect_workspaces_command())
+                removed = output.split()
+                if code == 0 and removed:
+                    self.log(f"🧹 已清理服务器上 {len(removed)} 个过期的工作空间")
+            except Exception:
+                # 清理失败不影响任务，下次启动时再试
+                with _collected_lock:
+                    _collected.discard(key)
+
+        threading.Thread(target=collect, daemon=True).start()
+
+    def remove_workspace(self):
+        """不需要保留工作空间时，任务结束后删除并等待完成；取消后留待继续的任务保留"""
+        if self.keep_workspace or self.ssh is None or (self.cancelled.is_set() and self.keep_pending):
+            return
+        try:
+            # 不经run_command：取消后它总是报“任务已取消”，而删除本身是成功的
+            code, _, errors = read_command(self.ssh, self.workspace.remove_command())
+            if code != 0:
+                raise Exception(errors)
+        except Exception as e:
+            self.log(f"⚠️ 删除工作空间失败，将由过期清理删除: {str(e)}")
+
+    def start_worker(self, ssh):
+        """获取常驻推理进程，不可用时退回脚本方式"""
+        try:
+            self.log("启动常驻推理进程...")
+            self.worker = get_worker(shared_pool.key(self.ssh_info), ssh)
+            self.log("✅ 常驻推理进程就绪")
+        except Exception as e:
+            self.worker = None
+            self.log(f"⚠️ 常驻推理进程不可用，改用脚本方式: {str(e)}")
+
+    def ensure_connected(self):
+        """连接在任务中途断开时透明重连"""
+        if shared_pool.is_alive(self.ssh):
+            return
+        self.log("⚠️ 连接已断开，正在重连...")
+        self.release()
+        self.ssh = shared_pool.get(self.ssh_info)
+        self.sftp = self.ssh.open_sftp()
+        self.transfers = TransferEngine(self.ssh, self.concurrency)
+
+    def local_path(self, file_type, index):
+        """第index组产物的本地保存路径，内存模式下为None"""
+        if self.output_dir is None:
+            return None
+        return self.output_path(self.pairs[index - 1], file_type)
+
+    def label(self, pair):
+        """一组图片的名称"""
+        return self.labels[tuple(pair)]
+
+    def output_path(self, pair, file_type):
+        """产物的本地保存路径，按组名称分目录"""
+        pair_dir = os.path.join(self.output_dir, self.label(pair))
+        os.makedirs(pair_dir, exist_ok=True)
+        return os.path.join(pair_dir, f"{file_type}.jpg")
+
+    def server_id(self):
+        """服务器标识，用于记录模型指纹"""
+        return f"{self.ssh_info['hostname']}:{self.ssh_info['port']}"
+
+    def cache_key(self, pair, fingerprint):
+        """一组图片在本地缓存中的键"""
+        if self.preprocess:
+            # 压缩参数不同，服务器看到的输入不同
+            fingerprint = f"{fingerprint}:{self.preprocess['max_size']}:{self.preprocess['quality']}"
+        return ResultCache.make_key(file_digest(pair[0]), file_digest(pair[1]), fingerprint)
+
+    def serve_cached(self):
+        """命中本地缓存的组直接返回结果，不连接服务器；全部命中时返回True"""
+        if self.cache is None or self.start_stage != "upload":
+            # 指定重跑某一步骤时总是重新计算，结果仍会存入缓存
+            return False
+        fingerprint = self.cache.get_fingerprint(self.server_id())
+        if fingerprint is None:
+            return False
+        pending = []
+        for pair in self.pairs:
+            files = self.cache.get(self.cache_key(pair, fingerprint))
+            if files is None:
+                pending.append(pair)
+                continue
+            self.log(f"♻️ {self.label(pair)} 命中本地缓存")
+            if self.output_dir is not None:
+                for kind, path in files.items():
+                    shutil.copyfile(path, self.output_path(pair, kind))
+                    files[kind] = self.output_path(pair, kind)
+            self.manifest[self.label(pair)] = {"input1": pair[0], "input2": pair[1], "cached": True, "local": files}
+            for kind in FETCHED_ARTIFACTS:
+                if kind != "composition" and kind in files:
+                    self.events.on_intermediate(kind, files[kind])
+            self.events.on_result(files["composition"])
+            self.journal.pair_done(pair)
+        self.pairs = pending
+        if pending:
+            return False
+        if self.output_dir is not None:
+            self.write_manifest()
+        self.log("✅ 全部结果来自本地缓存")
+        return True
+
+    def refresh_fingerprint(self, ssh):
+        """读取服务器当前的模型指纹"""
+        _, stdout, _ = ssh.exec_command(FINGERPRINT_COMMAND)
+        self.fingerprint = stdout.read().decode().strip()
+        self.cache.set_fingerprint(self.server_id(), self.fingerprint)
+
+    def finish_pair(self, index):
+        """一组计算完成：记录对应关系并存入本地缓存"""
+        pair = self.pairs[index - 1]
+        if self.output_dir is None:
+            # 内存模式：产物已通过回调交出，存入缓存后释放
+            files = {
+                kind: self.artifacts.pop((index, kind))
+                for kind in FETCHED_ARTIFACTS if (index, kind) in self.artifacts
+            }
+        else:
+            files = {kind: self.local_path(kind, index) for kind in FETCHED_ARTIFACTS}
+            self.manifest[self.label(pair)] = {
+                "input1": pair[0],
+                "input2": pair[1],
+                "remote": {kind: self.remote_artifact(kind, index) for kind in ARTIFACT_DIRS},
+                "local": files,
+            }
+        if self.cache is not None and self.fingerprint and len(files) == len(FETCHED_ARTIFACTS):
+            self.cache.put(self.cache_key(pair, self.fingerprint), files)
+        self.journal.pair_done(pair)
+
+    def upload_images(self):
+        """上传原始图片，依次编号为000001..N"""
+        try:
+            self.ensure_connected()
+            self.log("清理输入目录...")
+            inputs = " ".join(f"~/{self.workspace.input_dir(slot)}/*" for slot in (1, 2))
+            self.run_command(f"rm -rf {inputs} && {self.workspace.clear_checkpoints_command('upload')}")
+
+            store = ContentStore(self.ssh, self.sftp)
+            uploads = [
+                (path, self.workspace.input_path(slot, index))
+                for index, pair in enumerate(self.pairs, start=1)
+                for slot, path in enumerate(pair, start=1)
+            ]
+            self.log(f"上传 {len(self.pairs)} 组图片...")
+            self.put_inputs(store, uploads)
+
+            self.log("✅ 图片上传完成")
+            return True
+        except Exception as e:
+            self.log(f"❌ 上传失败: {str(e)}")
+            return False
+
+    def put_inputs(self, store, uploads):
+        """经内容寻址存储并发上传输入图片 [(本地路径, 服务器路径), ...]"""
+        def done(item, uploaded):
+            name = os.path.basename(item[0])
+            self.log(f"上传 {name} 完成" if uploaded else f"{name} 已在服务器上，跳过上传")
+
+        def put(sftp, item):
+            local_path, remote_path = item
+            # 在上传线程中完成预处理，内存中的图片直接经SFTP发送，不写临时文件
+            data = prepare_upload(local_path, self.preprocess)
+            return store.put(local_path, remote_path, sftp=sftp, data=data,
+                             callback=self.transfer_callback(remote_path))
+
+        self.transfers.map(self.in_current_span(put), uploads, done)
+
+    def process_warp(self):
+        """执行变形处理"""
+        try:
+            self.ensure_connected()
+            self.clear_remote(WARP_ARTIFACTS, "warp")
+
+            self.log("开始图像变形处理...")
+            # 变形中间产物边生成边下载
+            with self.stream_artifacts(WARP_ARTIFACTS):
+                self.run_stage(WARP_STAGE, "warp")
+            return True
+        except Exception as e:
+            self.log(f"❌ 变形处理失败: {str(e)}")
+            return False
+
+    def process_composition(self):
+        """执行融合处理"""
+        try:
+            self.ensure_connected()
+            self.clear_remote(COMPOSITION_ARTIFACTS, "composition")
+
+            self.log("开始图像融合处理...")
+            # 融合中间产物边生成边下载
+            with self.stream_artifacts(["learn_mask1", "learn_mask2"]):
+                self.run_stage(COMPOSITION_STAGE, "composition")
+            return True
+        except Exception as e:
+            self.log(f"❌ 融合处理失败: {str(e)}")
+            return False
+
+    def clear_remote(self, kinds, stage):
+        """清理服务器上stage的产物目录并等待完成，该步骤及之后的检查点随之作废"""
+        self.log("清理工作空间...")
+        for kind in kinds:
+            self.log(f"删除 ~/{self.workspace.artifact_dir(kind)}/*")
+        self.run_command(f"{self.workspace.clear_checkpoints_command(stage)} && {self.workspace.clear_command(kinds)}")
+
+    def run_command(self, command):
+        """执行命令并等待完成，返回输出，失败时抛出stderr内容"""
+        code, output, errors = read_command(self.ssh, command)
+        self.record_exit(code)
+        if self.cancelled.is_set():
+            raise Exception("任务已取消")
+        if code != 0:
+            raise Exception(errors)
+        return output
+
+    def run_stage(self, stage, name):
+        """执行阶段脚本：优先交给常驻推理进程，否则启动独立Python进程
+
+        独立进程的输出边运行边逐行转发到日志，失败时抛出最后的若干行。
+        常驻进程在任务结束后才返回输出，届时一并转发。
+        """
+        if self.cancelled.is_set():
+            raise Exception("任务已取消")
+        if self.worker is not None:
+            try:
+                code, output = self.worker.run(
+                    stage.script, self.workspace.path(stage.cwd), self.workspace.stage_args(),
+                    owner=self.job_id, cancelled=self.cancelled
+                )
+                self.record_exit(code)
+                for line in output.splitlines():
+                    self.stage_output(name, line)
+                if code != 0:
+                    raise Exception(output)
+                return
+            except WorkerError as e:
+                if self.cancelled.is_set():
+                    raise Exception("任务已取消")
+                self.log(f"⚠️ 常驻推理进程失效，改用脚本方式: {str(e)}")
+                discard_worker(shared_pool.key(self.ssh_info))
+                self.worker = None
+        code, output, errors = stream_command(
+            self.ssh, self.workspace.stage_command(stage), lambda line, _: self.stage_output(name, line)
+        )
+        self.record_exit(code)
+        if self.cancelled.is_set():
+            raise Exception("任务已取消")
+        if code != 0:
+            raise Exception(errors or output)
+
+    def stage_output(self, name, line):
+        """阶段脚本的一行输出：进度行转为进度回调（只在完成时转发），其余原样转发"""
+        progress = parse_progress(line)
+        if progress:
+            self.events.on_stage_progress(name, *progress)
+            if progress[0] < progress[1]:
+                return
+        if line.strip():
+            self.events.on_output(name, line)
+
+    def remote_artifact(self, kind, index):
+        """第index组产物在服务器上的路径"""
+        return self.workspace.artifact_path(kind, index)
+
+    @contextmanager
+    def stream_artifacts(self, kinds):
+        """阶段运行期间监视产物目录，文件写完即下载；阶段结束后补齐剩余文件并等待下载完成
+
+        剩余文件较多或链路延迟较大时一次打包取回；bundle为"always"时不边生成边下载，阶段结束后全部打包取回。
+        """
+        files = [(index, kind) for index in range(1, len(self.pairs) + 1) for kind in kinds]
+        if self.bundle == "always":
+            yield
+            try:
+                self.fetch_bundle(files, self.intermediate_done)
+            except Exception as e:
+                self.log(f"❌ 下载中间产物失败: {str(e)}")
+            return
+        pending = []
+        # 监视线程中提交的下载仍计入当前步骤
+        fetch = self.in_current_span(self.fetch_one)
+        watcher = RemoteWatcher(
+            self.ssh,
+            {kind: self.workspace.artifact_dir(kind) for kind in kinds},
+            lambda kind, filename: self.on_remote_file(kind, filename, pending, fetch)
+        )
+        watcher.start()
+        try:
+            yield
+        except Exception:
+            watcher.finish(sweep=False)
+            raise
+        watcher.finish(sweep=False)
+        # 监视期间没有取到的文件（阶段最后写出的，或监视失败时的全部文件）
+        remaining = [(index, kind) for index, kind in files if (kind, pair_name(index)) not in watcher.done]
+        try:
+            if remaining:
+                self.fetch_artifacts(remaining, self.intermediate_done)
+        except Exception as e:
+            self.log(f"❌ 下载中间产物失败: {str(e)}")
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                self.log(f"❌ 下载中间产物失败: {str(e)}")
+
+    def on_remote_file(self, kind, filename, pending, fetch):
+        """服务器上一个产物写完，用fetch(sftp, (组序号, 产物名))提交下载"""
+        try:
+            index = int(os.path.splitext(filename)[0])
+        except ValueError:
+            return
+        if 1 <= index <= len(self.pairs):
+            pending.append(self.transfers.submit(
+                fetch, (index, kind), lambda item, _: self.intermediate_done(*item)
+            ))
+
+    def download_result(self):
+        """下载每一组的最终结果"""
+        try:
+            self.ensure_connected()
+            files = [(index, "composition") for index in range(1, len(self.pairs) + 1)]
+            self.fetch_artifacts(files, self.result_done)
+            if self.output_dir is not None:
+                self.write_manifest()
+            self.log("✅ 最终结果下载完成")
+            return True
+        except Exception as e:
+            self.log(f"❌ 下载最终结果失败: {str(e)}")
+            return False
+
+    def fetch_artifacts(self, files, on_done):
+        """下载 [(组序号, 产物名), ...]，每完成一个文件调用 on_done(组序号, 产物名)"""
+        if self.use_bundle(len(files)):
+            self.fetch_bundle(files, on_done)
+        else:
+            self.transfers.map(self.in_current_span(self.fetch_one), files, lambda item, _: on_done(*item))
+
+    def use_bundle(self, count):
+        """本次下载是否打包传输"""
+        if self.bundle == "auto":
+            return self.transfers.prefers_bundle(count)
+        return self.bundle == "always"
+
+    def fetch_bundle(self, files, on_done):
+        """在一个通道中以tar流下载全部产物"""
+        items = {self.remote_artifact(kind, index): (index, kind) for index, kind in files}
+        self.log(f"打包下载 {len(items)} 个文件...")
+
+        def done(item, data):
+            index, kind = items[item[0]]
+            if data is not None:
+                self.artifacts[(index, kind)] = data
+            on_done(index, kind)
+
+        self.transfers.download_bundle(
+            [(remote_path, self.local_path(kind, index)) for remote_path, (index, kind) in items.items()],
+            self.compression, done, self.transfer_callback
+        )
+
+    def fetch_one(self, sftp, item):
+        """下载一个产物，item为(组序号, 产物名)；内存模式下经getfo直接读入内存"""
+        index, kind = item
+        remote_path = self.remote_artifact(kind, index)
+        callback = self.transfer_callback(remote_path)
+        if self.output_dir is None:
+            buffer = io.BytesIO()
+            sftp.getfo(remote_path, buffer, callback=callback)
+            self.artifacts[(index, kind)] = buffer.getvalue()
+        else:
+            sftp.get(remote_path, self.local_path(kind, index), callback=callback)
+
+    def artifact(self, index, kind):
+        """已下载产物：内存模式下为图片内容，否则为本地路径"""
+        if self.output_dir is None:
+            return self.artifacts[(index, kind)]
+        return self.local_path(kind, index)
+
+    def intermediate_done(self, index, kind):
+        """一个中间产物下载完成"""
+        self.events.on_intermediate(kind, self.artifact(index, kind))
+        self.log(f"下载 {self.label(self.pairs[index - 1])} {kind} 成功")
+
+    def result_done(self, index, kind):
+        """一组的最终结果下载完成"""
+        self.events.on_result(self.artifact(index, kind))
+        self.finish_pair(index)
+
+    def write_manifest(self):
+        """记录批量模式下每组源图片与服务器、本地产物的对应关系"""
+        merge_manifest(self.output_dir, self.manifest)
+
+
+class PipelinedFusion(FusionPipeline):
+    """流水线模式：上传、GPU计算、下载三个阶段重叠执行
+
+    第k+1组上传时第k组在做变形，第k组做融合时下载前面各组的产物。
+    服务器上逐组计算（输入固定为000001.jpg），阶段之间用有界队列衔接，
+    每个阶段在共享Transport上使用各自的通道。
+    """
+
+    QUEUE_SIZE = 2
+    # 产物逐组移到结果区后即已下载，工作空间没有复用价值，结束后删除
+    KEEP_WORKSPACE = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stop_event = threading.Event()
+        self.errors = []
+
+    def finish_pair(self, index):
+        """逐组完成时立即并入manifest.json，中途退出后恢复的任务只处理剩余的组，已完成组的记录不会丢失"""
+        super().finish_pair(index)
+        if self.output_dir is not None:
+            label = self.label(self.pairs[index - 1])
+            merge_manifest(self.output_dir, {label: self.manifest[label]})
+
+    def cancel(self, *args, **kwargs):
+        """取消时同时停止三个阶段的循环"""
+        self.stop_event.set()
+        return super().cancel(*args, **kwargs)
+
+    def run_steps(self):
+        try:
+            with self.span("cache"):
+                if self.serve_cached():
+                    return True
+
+            self.ssh = self.step("connect", self.connect_ssh)
+            if not self.ssh:
+                return False
+
+            staging, results = self.workspace.path(STAGING_DIR), self.workspace.path(RESULTS_DIR)
+            self.run_command(f"rm -rf ~/{staging} ~/{results} && mkdir -p ~/{staging} ~/{results}")
+            upload_queue = queue.Queue(self.QUEUE_SIZE)
+            download_queue = queue.Queue(self.QUEUE_SIZE)
+            workers = [
+                threading.Thread(target=self.guarded, args=(self.upload_loop, None, upload_queue)),
+                threading.Thread(target=self.guarded, args=(self.gpu_loop, upload_queue, download_queue)),
+                threading.Thread(target=self.guarded, args=(self.download_loop, download_queue, None)),
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+            if self.cancelled.is_set():
+                return False
+            if self.errors:
+                self.log(f"❌ 流水线执行失败: {self.errors[0]}")
+                return False
+            if self.output_dir is not None:
+                self.write_manifest()
+            self.log("✅ 全部结果下载完成")
+            return True
+
+        except Exception as e:
+            self.log(f"❌ 发生错误: {str(e)}")
+            return False
+        finally:
+            self.remove_workspace()
+            self.release()
+
+    def remote_artifact(self, kind, index):
+        """流水线模式下产物移动到结果区"""
+        return self.workspace.result_path(kind, index)
+
+    def guarded(self, loop, in_queue, out_queue):
+        """运行一个阶段，出错时通知其余阶段停止，结束时向下游发送结束标记"""
+        try:
+            loop(in_queue, out_queue)
+        except Exception as e:
+            self.errors.append(str(e))
+            self.stop_event.set()
+        finally:
+            if out_queue is not None:
+                self.put_queue(out_queue, None)
+
+    def put_queue(self, q, item):
+        """放入有界队列，队列满时等待，流水线停止时放弃"""
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def get_queue(self, q):
+        """从队列取出一项，流水线停止时返回None"""
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return None
+
+    def upload_loop(self, _, out_queue):
+        """上传阶段：依次把每组图片上传到暂存区"""
+        total = len(self.pairs)
+        store = ContentStore(self.ssh, self.sftp)
+        for index, (path1, path2) in enumerate(self.pairs, start=1):
+            if self.stop_event.is_set():
+                return
+            self.log(f"上传第 {index}/{total} 组图片...")
+            with self.span("upload", index):
+                self.sftp.mkdir(self.workspace.path(f"{STAGING_DIR}/{index:06d}"))
+                self.put_inputs(store, [
+                    (path1, self.workspace.staged_input_path(1, index)),
+                    (path2, self.workspace.staged_input_path(2, index)),
+                ])
+            self.put_queue(out_queue, index)
+
+    def gpu_loop(self, in_queue, out_queue):
+        """计算阶段：逐组移入输入目录，执行变形与融合，产物移到结果区"""
+        total = len(self.pairs)
+        while True:
+            index = self.get_queue(in_queue)
+            if index is None:
+                return
+            workspace = self.workspace
+            inputs = " ".join(f"~/{workspace.input_dir(slot)}/*" for slot in (1, 2))
+            self.run_command(
+                f"rm -rf {inputs} && {workspace.clear_command(ARTIFACT_DIRS)}"
+                f" && {workspace.clear_checkpoints_command('upload')}"
+                f" && mv ~/{workspace.staged_input_path(1, index)} ~/{workspace.input_path(1, 1)}"
+                f" && mv ~/{workspace.staged_input_path(2, index)} ~/{workspace.input_path(2, 1)}"
+            )
+
+            self.log(f"第 {index}/{total} 组：开始图像变形处理...")
+            with self.span("warp", index):
+                self.run_stage(WARP_STAGE, "warp")
+            self.run_command(self.stash_command(WARP_ARTIFACTS, index, "cp"))
+            self.put_queue(out_queue, (index, "warp"))
+
+            self.log(f"第 {index}/{total} 组：开始图像融合处理...")
+            with self.span("composition", index):
+                self.run_stage(COMPOSITION_STAGE, "composition")
+            self.run_command(self.stash_command(COMPOSITION_ARTIFACTS, index, "mv"))
+            self.put_queue(out_queue, (index, "composition"))
+
+    def stash_command(self, kinds, index, op):
+        """把当前产物复制/移动到第index组结果区的命令"""
+        parts = [f"mkdir -p ~/{self.workspace.path(RESULTS_DIR)}/{index:06d}"]
+        parts += [
+            f"{op} ~/{self.workspace.artifact_path(kind, 1)} ~/{self.workspace.result_path(kind, index)}"
+            for kind in kinds
+        ]
+        return " && ".join(parts)
+
+    def download_loop(self, in_queue, _):
+        """下载阶段：拉取结果区中已完成的产物"""
+        total = len(self.pairs)
+        while True:
+            item = self.get_queue(in_queue)
+            if item is None:
+                return
+            index, stage = item
+            kinds = WARP_ARTIFACTS if stage == "warp" else ["learn_mask1", "learn_mask2"]
+            with self.span("download", index):
+                self.fetch_artifacts([(index, kind) for kind in kinds], self.intermediate_done)
+                if stage == "composition":
+                    self.fetch_artifacts([(index, "composition")], self.result_done)
+            if stage == "composition":
+                self.log(f"✅ 第 {index}/{total} 组结果下载完成")
+
+
+def merge_manifest(output_dir, entries):
+    """把各组的记录合并进output_dir/manifest.json
+
+    恢复的任务与分发的各组只持有部分组的记录，已有文件中其他组的记录保留。
+    """
+    path = os.path.join(output_dir, "manifest.json")
+    with _manifest_lock:
+        try:
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest.update(entries)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+
+def pair_label(pair):
+    """一组图片的名称（input1的文件名去掉扩展名）"""
+    return os.path.splitext(os.path.basename(pair[0]))[0]
+
+
+def pair_labels(pairs):
+    """各组不重复的名称 {(input1路径, input2路径): 名称}
+
+    一般为input1的文件名；不同目录下的input1同名时，这几组在前面加上组序号（000001_left），避免产物互相覆盖。
+    """
+    names = [pair_label(pair) for pair in pairs]
+    counts = Counter(names)
+    return {
+        tuple(pair): name if counts[name] == 1 else f"{index:06d}_{name}"
+        for index, (pair, name) in enumerate(zip(pairs, names), start=1)
+    }
+
+
+def collect_pairs(folder):
+    """按文件名配对folder/input1与folder/input2中的图片"""
+    exts = (".jpg", ".jpeg", ".png")
+    dir1, dir2 = os.path.join(folder, "input1"), os.path.join(folder, "input2")
+    if not (os.path.isdir(dir1) and os.path.isdir(dir2)):
+        return []
+    names = sorted(
+        set(os.listdir(dir1)) & set(os.listdir(dir2))
+    )
+    return [
+        (os.path.join(dir1, name), os.path.join(dir2, name))
+        for name in names if name.lower().endswith(exts)
+    ]
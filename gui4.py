@@ -1,133 +1,47 @@
 import sys
-import paramiko
 import time
-from scp import SCPClient
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QPushButton,
     QLineEdit, QFileDialog, QTextEdit, QMessageBox, QStackedWidget, QHBoxLayout
 )
 from PyQt6.QtGui import QPixmap
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from ssh_pool import shared_pool
+from fusion_pipeline import FusionPipeline, PipelineEvents
 
 
 # ============================================================
 #                        线程工作类（优化版）
 # ============================================================
 
-class OperationThread(QThread):
-    """集成化操作线程"""
+class OperationThread(QThread, PipelineEvents):
+    """集成化操作线程，在后台运行融合流程"""
     progress = pyqtSignal(str)  # 进度信号
     finished = pyqtSignal(bool)  # 完成信号（True=成功，False=失败）
-    result_ready = pyqtSignal(str)  # 结果文件路径
+    result_ready = pyqtSignal(bytes)  # 结果图片内容
 
     def __init__(self, ssh_info, image_paths):
         super().__init__()
         self.ssh_info = ssh_info  # 服务器连接信息
-        self.image_paths = image_paths
-        self.ssh = None
+        self.pipeline = FusionPipeline(ssh_info, [(image_paths[1], image_paths[2])], events=self)
         self.should_stop = False  # 异常终止标志
 
     def run(self):
-        try:
-            # 步骤1：建立SSH连接
-            self.progress.emit("正在连接服务器...")
-            self.ssh = self.connect_ssh()
-            if not self.ssh: return
-
-            # 步骤2：上传图片
-            if not self.upload_images():
-                self.finished.emit(False)
-                return
-
-            # 步骤3：执行处理
-            if not self.process_images():
-                self.finished.emit(False)
-                return
-
-            # 步骤4：下载结果
-            result_path = self.download_result()
-            if result_path:
-                self.result_ready.emit(result_path)
-                self.finished.emit(True)
-            else:
-                self.finished.emit(False)
-
-        except Exception as e:
-            self.progress.emit(f"❌ 发生错误: {str(e)}")
-            self.finished.emit(False)
-
-    def connect_ssh(self):
-        """建立SSH连接"""
-        try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(**self.ssh_info, timeout=15)
-            self.progress.emit("✅ 服务器连接成功")
-            return ssh
-        except Exception as e:
-            self.progress.emit(f"❌ 连接失败: {str(e)}")
-            return None
-
-    def upload_images(self):
-        """上传图片"""
-        try:
-            with SCPClient(self.ssh.get_transport()) as scp:
-                # 上传input1
-                self.progress.emit("上传input1图片...")
-                self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS-D/testing/input1/*")
-                scp.put(self.image_paths[1], "~/autodl-tmp/UDIS-D/testing/input1/000001.jpg")
-
-                # 上传input2
-                self.progress.emit("上传input2图片...")
-                self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS-D/testing/input2/*")
-                scp.put(self.image_paths[2], "~/autodl-tmp/UDIS-D/testing/input2/000001.jpg")
-
-            self.progress.emit("✅ 图片上传完成")
-            return True
-        except Exception as e:
-            self.progress.emit(f"❌ 上传失败: {str(e)}")
-            return False
-
-    def process_images(self):
-        """执行处理"""
-        try:
-            self.progress.emit("开始图像变形处理...")
-            _, stdout, stderr = self.ssh.exec_command(
-                "/root/miniconda3/bin/python ~/autodl-tmp/UDIS2-main/Warp/Codes/test_output.py"
-            )
-            if stdout.channel.recv_exit_status() != 0:
-                raise Exception(stderr.read().decode())
-
-            self.progress.emit("开始图像融合处理...")
-            _, stdout, stderr = self.ssh.exec_command(
-                "/root/miniconda3/bin/python ~/autodl-tmp/UDIS2-main/Composition/Codes/test.py"
-            )
-            if stdout.channel.recv_exit_status() != 0:
-                raise Exception(stderr.read().decode())
-
-            self.progress.emit("✅ 图像处理完成")
-            return True
-        except Exception as e:
-            self.progress.emit(f"❌ 处理失败: {str(e)}")
-            return False
-
-    def download_result(self):
-        """下载结果"""
-        try:
-            local_path = "fusion_result.jpg"
-            with SCPClient(self.ssh.get_transport()) as scp:
-                scp.get("~/autodl-tmp/UDIS2-main/Composition/composition/000001.jpg", local_path)
-            self.progress.emit("✅ 结果下载完成")
-            return local_path
-        except Exception as e:
-            self.progress.emit(f"❌ 下载失败: {str(e)}")
-            return None
+        self.progress.emit("正在连接服务器...")
+        self.finished.emit(self.pipeline.run())
+
+    def on_progress(self, message):
+        self.progress.emit(message)
+
+    def on_result(self, source):
+        self.result_ready.emit(source)
 
     def stop(self):
-        """终止操作"""
+        """终止操作：结束服务器上正在运行的步骤并等待GPU释放，随后run()返回"""
         self.should_stop = True
-        if self.ssh:
-            self.ssh.close()
+        if not self.pipeline.cancel():
+            # 无法确认远程进程已结束时断开连接，避免阻塞在等待命令返回上
+            shared_pool.discard(self.ssh_info)
 
 
 # ============================================================
@@ -276,9 +190,11 @@ class FusionApp(QWidget):
         if not success:
             QMessageBox.critical(self, "错误", "处理流程未完成，请检查日志")
 
-    def show_result(self, file_path):
+    def show_result(self, data):
         """显示结果图片"""
-        pixmap = QPixmap(file_path).scaled(400, 400, Qt.AspectRatioMode.KeepAspectRatio)
+        pixmap = QPixmap()
+        pixmap.loadFromData(data)
+        pixmap = pixmap.scaled(400, 400, Qt.AspectRatioMode.KeepAspectRatio)
         self.lbl_result.setPixmap(pixmap)
         self.log("✅ 结果已显示")
 
@@ -293,6 +209,7 @@ class FusionApp(QWidget):
         if self.operation_thread and self.operation_thread.isRunning():
             self.operation_thread.stop()
             self.operation_thread.wait()
+        shared_pool.close_all()
         event.accept()
 
 
@@ -1,181 +1,96 @@
+from startup_profile import startup
+import os
 import sys
-import paramiko
 import time
-from scp import SCPClient
+import threading
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QPushButton,
-    QLineEdit, QFileDialog, QTextEdit, QMessageBox, QHBoxLayout,
-    QScrollArea, QFrame, QSizePolicy, QSpacerItem
+    QLineEdit, QFileDialog, QPlainTextEdit, QMessageBox, QHBoxLayout,
+    QScrollArea, QFrame, QSizePolicy, QSpacerItem, QCheckBox, QSpinBox, QProgressBar,
+    QComboBox, QTableWidget, QTableWidgetItem, QHeaderView, QInputDialog
 )
 from PyQt6.QtGui import QPixmap, QCursor
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QObject, QTimer, pyqtSignal
+from ssh_pool import shared_pool, preload
+from result_cache import ResultCache
+from transfer import TransferStats, format_size
+from image_loader import ImageLoader
+from fusion_pipeline import PipelineEvents, collect_pairs
+from dispatcher import ServerState, create_pipeline, queue_job, job_arguments
+from job_queue import JobQueue, remaining_pairs
+from job_executor import JobExecutor, ExecutorEvents
+from telemetry import RunLog, Span, span_duration
+from log_sink import LogBuffer, LEVELS, DEFAULT_LOG_DIR, format_entry
+
+startup.mark("导入依赖")
 
 # ============================================================
-#                        线程工作类
+#                        任务信号中心
 # ============================================================
-class FusionThread(QThread):
-    progress = pyqtSignal(str)
-    result_ready = pyqtSignal(str)
-    intermediate_ready = pyqtSignal(str, str)
-    finished = pyqtSignal(bool)
+class JobHub(QObject, ExecutorEvents):
+    """把各任务的流程回调转成带任务ID的Qt信号，执行器在后台线程中发出，界面线程中处理
 
-    def __init__(self, ssh_info, image_paths):
-        super().__init__()
-        self.ssh_info = ssh_info
-        self.image_paths = image_paths
-        self.ssh = None
-
-    def run(self):
-        try:
-            # 连接服务器
-            self.ssh = self.connect_ssh()
-            if not self.ssh:
-                self.finished.emit(False)
-                return
-
-            # 上传图片
-            if not self.upload_images():
-                self.finished.emit(False)
-                return
-
-            # 处理变形并获取中间产物
-            if not self.process_warp():
-                self.finished.emit(False)
-                return
-
-            # 处理融合并获取中间产物
-            if not self.process_composition():
-                self.finished.emit(False)
-                return
-
-            # 下载最终结果
-            final_path = self.download_result()
-            if final_path:
-                self.result_ready.emit(final_path)
-                self.finished.emit(True)
-            else:
-                self.finished.emit(False)
-
-        except Exception as e:
-            self.progress.emit(f"❌ 发生错误: {str(e)}")
-            self.finished.emit(False)
-        finally:
-            if self.ssh:
-                self.ssh.close()
-
-    def connect_ssh(self):
-        """建立SSH连接"""
-        try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(**self.ssh_info, timeout=15)
-            self.progress.emit("✅ 服务器连接成功")
-            return ssh
-        except Exception as e:
-            self.progress.emit(f"❌ 连接失败: {str(e)}")
-            return None
+    日志量大，不走信号，直接写入线程安全的LogBuffer，由界面定时批量显示。
+    """
+    started = pyqtSignal(str)
+    intermediate = pyqtSignal(str, str, object)  # 任务ID, 产物类型, 文件路径或图片内容
+    result = pyqtSignal(str, object)
+    transfer = pyqtSignal(str, TransferStats)
+    span = pyqtSignal(str, Span)
+    stage_progress = pyqtSignal(str, str, int, int)  # 任务ID, 步骤, 已完成, 总数
+    finished = pyqtSignal(str, bool)
+
+    def __init__(self, sink, parent=None):
+        super().__init__(parent)
+        self.sink = sink
+
+    def events(self, job_id):
+        """交给流程的回调对象"""
+        return HubEvents(self, job_id)
+
+    def on_job_started(self, job_id):
+        self.started.emit(job_id)
+
+    def on_job_finished(self, job_id, ok):
+        self.finished.emit(job_id, ok)
+
+
+class HubEvents(PipelineEvents):
+    """一个任务的流程回调，转发到JobHub"""
+
+    def __init__(self, hub, job_id):
+        self.hub = hub
+        self.job_id = job_id
+
+    def on_progress(self, message):
+        self.hub.sink.append(message, job_id=self.job_id)
+
+    def on_output(self, stage, line):
+        self.hub.sink.append(line, "debug", self.job_id)
+
+    def on_intermediate(self, kind, source):
+        self.hub.intermediate.emit(self.job_id, kind, source)
+
+    def on_result(self, source):
+        self.hub.result.emit(self.job_id, source)
+
+    def on_transfer(self, stats):
+        self.hub.transfer.emit(self.job_id, stats)
+
+    def on_span(self, span):
+        self.hub.span.emit(self.job_id, span)
+
+    def on_stage_progress(self, stage, done, total):
+        self.hub.stage_progress.emit(self.job_id, stage, done, total)
+
+
+# 单组处理勾选“保存产物”时的本地输出根目录
+JOB_OUTPUT_DIR = "udis_output"
+# 日志区最多显示的行数，更早的只保留在日志文件中
+MAX_LOG_LINES = 5000
+# 日志区刷新间隔（毫秒），期间到达的日志合并为一次追加
+LOG_FLUSH_INTERVAL = 100
 
-    def upload_images(self):
-        """上传原始图片"""
-        try:
-            with SCPClient(self.ssh.get_transport()) as scp:
-                self.progress.emit("上传input1图片...")
-                self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS-D/testing/input1/*")
-                scp.put(self.image_paths[1], "~/autodl-tmp/UDIS-D/testing/input1/000001.jpg")
-
-                self.progress.emit("上传input2图片...")
-                self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS-D/testing/input2/*")
-                scp.put(self.image_paths[2], "~/autodl-tmp/UDIS-D/testing/input2/000001.jpg")
-
-            self.progress.emit("✅ 图片上传完成")
-            return True
-        except Exception as e:
-            self.progress.emit(f"❌ 上传失败: {str(e)}")
-            return False
-
-    def process_warp(self):
-        """执行变形处理"""
-        try:
-            self.progress.emit("清理工作空间...")
-            self.progress.emit("删除 ~/autodl-tmp/UDIS-D/testing/warp1/*")
-            self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS-D/testing/warp1/*")
-            self.progress.emit("删除 ~/autodl-tmp/UDIS-D/testing/warp2/*")
-            self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS-D/testing/warp2/*")
-            self.progress.emit("删除 ~/autodl-tmp/UDIS-D/testing/mask1/*")
-            self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS-D/testing/mask1/*")
-            self.progress.emit("删除 ~/autodl-tmp/UDIS-D/testing/mask2/*")
-            self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS-D/testing/mask2/*")
-
-            self.progress.emit("开始图像变形处理...")
-            _, stdout, stderr = self.ssh.exec_command(
-                "/root/miniconda3/bin/python ~/autodl-tmp/UDIS2-main/Warp/Codes/test_output.py"
-            )
-            if stdout.channel.recv_exit_status() != 0:
-                raise Exception(stderr.read().decode())
-            self.progress.emit(stdout.read().decode())
-            # 下载变形中间产物
-            intermediates = [
-                ("warp1", "autodl-tmp/UDIS-D/testing/warp1/000001.jpg"),
-                ("warp2", "autodl-tmp/UDIS-D/testing/warp2/000001.jpg")
-            ]
-            self.download_intermediates(intermediates)
-            return True
-        except Exception as e:
-            self.progress.emit(f"❌ 变形处理失败: {str(e)}")
-            return False
-
-    def process_composition(self):
-        """执行融合处理"""
-        try:
-            self.progress.emit("清理工作空间...")
-            self.progress.emit("删除 ~/autodl-tmp/UDIS2-main/Composition/learn_mask1/*")
-            self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS2-main/Composition/learn_mask1/*")
-            self.progress.emit("删除 ~/autodl-tmp/UDIS2-main/Composition/learn_mask2/*")
-            self.ssh.exec_command("rm -rf ~/autodl-tmp/UDIS2-main/Composition/learn_mask2/*")
-
-            self.progress.emit("开始图像融合处理...")
-            _, stdout, stderr = self.ssh.exec_command(
-                "cd autodl-tmp/UDIS2-main/Composition/Codes && /root/miniconda3/bin/python test.py"
-            )
-            if stdout.channel.recv_exit_status() != 0:
-                raise Exception(stderr.read().decode())
-            self.progress.emit(stdout.read().decode())
-            # 下载融合中间产物
-            intermediates = [
-                ("learn_mask1", "autodl-tmp/UDIS2-main/Composition/learn_mask1/000001.jpg"),
-                ("learn_mask2", "autodl-tmp/UDIS2-main/Composition/learn_mask2/000001.jpg")
-            ]
-            self.download_intermediates(intermediates)
-            return True
-        except Exception as e:
-            self.progress.emit(f"❌ 融合处理失败: {str(e)}")
-            return False
-
-    def download_intermediates(self, files):
-        """下载中间产物"""
-        try:
-            with SCPClient(self.ssh.get_transport()) as scp:
-                for file_type, remote_path in files:
-                    local_path = f"{file_type}.jpg"
-                    scp.get(f"~/{remote_path}", local_path)
-                    self.intermediate_ready.emit(file_type, local_path)
-                    self.progress.emit(f"下载 {file_type} 成功")
-            return True
-        except Exception as e:
-            self.progress.emit(f"❌ 下载中间产物失败: {str(e)}")
-            return False
-
-    def download_result(self):
-        """下载最终结果"""
-        try:
-            local_path = "final_result.jpg"
-            with SCPClient(self.ssh.get_transport()) as scp:
-                scp.get("~/autodl-tmp/UDIS2-main/Composition/composition/000001.jpg", local_path)
-            self.progress.emit("✅ 最终结果下载完成")
-            return local_path
-        except Exception as e:
-            self.progress.emit(f"❌ 下载最终结果失败: {str(e)}")
-            return None
 
 # ============================================================
 #                        主界面类
@@ -183,8 +98,20 @@ class FusionThread(QThread):
 class FusionApp(QWidget):
     def __init__(self):
         super().__init__()
-        self.thread = None
         self.image_paths = {1: None, 2: None}
+        self.servers = []  # 多服务器分发的服务器列表 [ServerState, ...]
+        self.result_cache = ResultCache()
+        self.run_log = RunLog()
+        self.job_queue = JobQueue()
+        # 全部日志同时写入本次运行的日志文件
+        self.log_sink = LogBuffer(spill_path=os.path.join(DEFAULT_LOG_DIR, time.strftime("gui-%Y%m%d-%H%M%S.log")))
+        self.hub = JobHub(self.log_sink, self)
+        self.executor = JobExecutor(events=self.hub)
+        self.pipelines = {}  # {任务ID: 流程}，排队中与运行中的任务
+        self.current_job = None  # 界面上显示图片与传输进度的任务（最近提交的）
+        self.image_loader = ImageLoader(parent=self)
+        self.image_loader.loaded.connect(self.on_image_loaded)
+        startup.mark("结果缓存与解码线程")
         self.init_ui()
         self.setup_connections()
 
@@ -232,31 +159,119 @@ class FusionApp(QWidget):
         server_layout.addWidget(self.txt_port)
         server_layout.addWidget(QLabel("密码:"))
         server_layout.addWidget(self.txt_pwd)
+        server_layout.addWidget(QLabel("并发上限:"))
+        self.spin_server_jobs = QSpinBox()
+        self.spin_server_jobs.setRange(1, 8)
+        self.spin_server_jobs.setToolTip("该服务器同时处理的组数与同时运行的任务数，各有独立的工作空间，受GPU显存限制")
+        server_layout.addWidget(self.spin_server_jobs)
+        self.btn_add_server = QPushButton("加入服务器列表")
+        self.btn_add_server.setToolTip("列表非空时，每组图片分发到负载最低的可用服务器，掉线时自动转到其他服务器")
+        self.btn_clear_servers = QPushButton("清空")
+        self.lbl_servers = QLabel("服务器列表: 0 台")
+        server_layout.addWidget(self.btn_add_server)
+        server_layout.addWidget(self.btn_clear_servers)
+        server_layout.addWidget(self.lbl_servers)
         left_content.addWidget(server_frame)
 
         # 操作按钮区域
         btn_layout = QHBoxLayout()
         btn_layout.addStretch(1)
         self.btn_start = QPushButton("开始融合处理")
-        self.btn_start.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
-        self.btn_start.setStyleSheet("""
+        self.btn_recompose = QPushButton("只重跑合成")
+        self.btn_recompose.setToolTip("复用服务器上这组图片已有的上传与变形结果，只重新执行合成并下载")
+        self.btn_batch = QPushButton("批量融合处理")
+        for btn in [self.btn_start, self.btn_recompose, self.btn_batch]:
+            btn.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
+            btn.setStyleSheet("""
+                QPushButton {
+                    background-color: #2196F3;
+                    color: white;
+                    padding: 12px 25px;
+                    font-size: 16px;
+                    border-radius: 8px;
+                }
+                QPushButton:hover {
+                    background-color: #1976D2;
+                }
+                QPushButton:disabled {
+                    background-color: #BBDEFB;
+                }
+            """)
+            btn_layout.addWidget(btn)
+        self.btn_cancel = QPushButton("全部取消")
+        self.btn_cancel.setToolTip("取消排队中与进行中的全部任务，终止服务器上正在运行的步骤并等待GPU释放")
+        self.btn_cancel.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
+        self.btn_cancel.setStyleSheet("""
             QPushButton {
-                background-color: #2196F3;
+                background-color: #F44336;
                 color: white;
                 padding: 12px 25px;
                 font-size: 16px;
                 border-radius: 8px;
             }
             QPushButton:hover {
-                background-color: #1976D2;
+                background-color: #D32F2F;
             }
             QPushButton:disabled {
-                background-color: #BBDEFB;
+                background-color: #FFCDD2;
             }
         """)
-        btn_layout.addWidget(self.btn_start)
+        self.btn_cancel.setEnabled(False)
+        btn_layout.addWidget(self.btn_cancel)
+        btn_layout.addWidget(QLabel("并行任务:"))
+        self.spin_jobs = QSpinBox()
+        self.spin_jobs.setRange(1, 16)
+        self.spin_jobs.setValue(self.executor.max_workers)
+        self.spin_jobs.setToolTip("同时运行的任务数；每台服务器上默认同时只运行一个任务")
+        btn_layout.addWidget(self.spin_jobs)
+        self.lbl_jobs = QLabel("")
+        btn_layout.addWidget(self.lbl_jobs)
+        self.chk_pipeline = QCheckBox("流水线模式")
+        self.chk_pipeline.setToolTip("批量处理时上传、计算、下载重叠执行")
+        btn_layout.addWidget(self.chk_pipeline)
+        self.chk_cache = QCheckBox("结果缓存")
+        self.chk_cache.setToolTip("相同输入与模型的结果直接从本地缓存返回")
+        self.chk_cache.setChecked(True)
+        btn_layout.addWidget(self.chk_cache)
+        self.chk_save = QCheckBox("保存产物")
+        self.chk_save.setToolTip(f"单组处理的产物默认只在内存中显示，勾选后保存到 {JOB_OUTPUT_DIR}/<时间>/")
+        btn_layout.addWidget(self.chk_save)
+        self.chk_worker = QCheckBox("常驻推理进程")
+        self.chk_worker.setToolTip("在服务器上保持模型常驻，省去每次启动Python与加载权重的时间")
+        btn_layout.addWidget(self.chk_worker)
+        btn_layout.addWidget(QLabel("并发传输:"))
+        self.spin_concurrency = QSpinBox()
+        self.spin_concurrency.setRange(1, 16)
+        self.spin_concurrency.setValue(4)
+        btn_layout.addWidget(self.spin_concurrency)
+        self.chk_preprocess = QCheckBox("上传前压缩")
+        self.chk_preprocess.setToolTip("按EXIF方向摆正，缩小到最长边以内并重新编码为JPEG后再上传")
+        btn_layout.addWidget(self.chk_preprocess)
+        btn_layout.addWidget(QLabel("最长边:"))
+        self.spin_max_size = QSpinBox()
+        self.spin_max_size.setRange(256, 8192)
+        self.spin_max_size.setSingleStep(128)
+        self.spin_max_size.setValue(1600)
+        btn_layout.addWidget(self.spin_max_size)
+        btn_layout.addWidget(QLabel("质量:"))
+        self.spin_quality = QSpinBox()
+        self.spin_quality.setRange(50, 100)
+        self.spin_quality.setValue(90)
+        btn_layout.addWidget(self.spin_quality)
+        btn_layout.addWidget(QLabel("打包下载:"))
+        self.combo_bundle = QComboBox()
+        for text, mode in [("自动", "auto"), ("总是", "always"), ("从不", "never")]:
+            self.combo_bundle.addItem(text, mode)
+        self.combo_bundle.setToolTip("文件多或延迟大时把产物打成一个tar流下载")
+        btn_layout.addWidget(self.combo_bundle)
+        self.combo_compression = QComboBox()
+        for text, method in [("不压缩", None), ("gzip", "gzip"), ("zstd", "zstd")]:
+            self.combo_compression.addItem(text, method)
+        self.combo_compression.setToolTip("打包下载时的压缩方式，zstd需要本地安装zstandard")
+        btn_layout.addWidget(self.combo_compression)
         btn_layout.addStretch(1)
         left_content.addLayout(btn_layout)
+        startup.mark("界面: 服务器信息与按钮")
 
         # 下部内容：左右分栏（左边固定宽度640：图片选择和结果展示；右边：推理过程）
         lower_layout = QHBoxLayout()
@@ -305,7 +320,7 @@ class FusionApp(QWidget):
         intermediate_layout.setContentsMargins(15, 15, 15, 15)
 
         # 变形处理中间产物
-        self.warp_group = self.create_intermediate_group("配准阶段", ["warp1", "warp2"], 240)
+        self.warp_group = self.create_intermediate_group("配准阶段", ["warp1", "warp2", "mask1", "mask2"], 240)
         # 融合处理中间产物
         self.comp_group = self.create_intermediate_group("合成阶段", ["learn_mask1", "learn_mask2"], 240)
         intermediate_layout.addWidget(self.warp_group)
@@ -318,6 +333,7 @@ class FusionApp(QWidget):
 
         left_content.addLayout(lower_layout)
         main_layout.addLayout(left_content, 3)
+        startup.mark("界面: 图片与产物区域")
 
         # 右侧：控制台（日志输出区域）
         console_layout = QVBoxLayout()
@@ -332,9 +348,22 @@ class FusionApp(QWidget):
             }
         """)
         console_layout.addWidget(console_title)
-        self.log_area = QTextEdit()
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("显示:"))
+        self.combo_log_level = QComboBox()
+        for text, level in [("全部（含脚本输出）", "debug"), ("进度", "info"), ("警告及错误", "warning"), ("仅错误", "error")]:
+            self.combo_log_level.addItem(text, level)
+        self.combo_log_level.setCurrentIndex(1)
+        filter_layout.addWidget(self.combo_log_level, 1)
+        self.lbl_log_file = QLabel("完整日志")
+        self.lbl_log_file.setToolTip(self.log_sink.spill_path)
+        self.lbl_log_file.setStyleSheet("color: #666; font-size: 12px;")
+        filter_layout.addWidget(self.lbl_log_file)
+        console_layout.addLayout(filter_layout)
+        self.log_area = QPlainTextEdit()
+        self.log_area.setMaximumBlockCount(MAX_LOG_LINES)
         self.log_area.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: #fff;
                 border: 1px solid #ddd;
                 padding: 10px;
@@ -344,12 +373,38 @@ class FusionApp(QWidget):
         """)
         self.log_area.setReadOnly(True)
         console_layout.addWidget(self.log_area)
+        # 阶段进度：来自服务器脚本输出的 "i/N" 进度行
+        self.stage_bar = QProgressBar()
+        self.stage_bar.setRange(0, 1)
+        self.stage_bar.setValue(0)
+        self.stage_bar.setFormat("")
+        console_layout.addWidget(self.stage_bar)
+        # 传输进度：字节数超出int范围，进度条按千分比显示
+        self.transfer_bar = QProgressBar()
+        self.transfer_bar.setRange(0, 1000)
+        self.transfer_bar.setTextVisible(False)
+        console_layout.addWidget(self.transfer_bar)
+        self.transfer_label = QLabel("")
+        self.transfer_label.setStyleSheet("color: #666; font-size: 12px;")
+        console_layout.addWidget(self.transfer_label)
+        # 耗时明细：每个步骤一行，任务结束时追加合计
+        timing_title = QLabel("耗时明细")
+        timing_title.setStyleSheet("font-weight: bold; font-size: 14px; margin-top: 6px;")
+        console_layout.addWidget(timing_title)
+        self.timing_table = QTableWidget(0, 6)
+        self.timing_table.setHorizontalHeaderLabels(["任务", "步骤", "组", "耗时(秒)", "传输", "退出码"])
+        self.timing_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.timing_table.verticalHeader().setVisible(False)
+        self.timing_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.timing_table.setFixedHeight(200)
+        console_layout.addWidget(self.timing_table)
         self.console_widget = QWidget()
         self.console_widget.setLayout(console_layout)
         self.console_widget.setFixedWidth(400)
         main_layout.addWidget(self.console_widget, 0)
 
         self.setLayout(main_layout)
+        startup.mark("界面: 控制台")
 
     def create_input_box(self, name, prompt):
         """创建输入图片框，固定尺寸230×230"""
@@ -451,7 +506,25 @@ class FusionApp(QWidget):
         """设置信号连接"""
         self.lbl_img1.mousePressEvent = lambda e: self.select_image(1)
         self.lbl_img2.mousePressEvent = lambda e: self.select_image(2)
-        self.btn_start.clicked.connect(self.start_process)
+        self.btn_start.clicked.connect(lambda: self.start_process())
+        self.btn_recompose.clicked.connect(lambda: self.start_process("composition"))
+        self.btn_batch.clicked.connect(self.start_batch_process)
+        self.btn_add_server.clicked.connect(self.add_server)
+        self.btn_clear_servers.clicked.connect(self.clear_servers)
+        self.btn_cancel.clicked.connect(self.cancel_process)
+        self.spin_jobs.valueChanged.connect(self.executor.set_max_workers)
+        self.hub.started.connect(self.handle_job_started)
+        self.combo_log_level.currentIndexChanged.connect(self.refilter_log)
+        self.log_timer = QTimer(self)
+        self.log_timer.setInterval(LOG_FLUSH_INTERVAL)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start()
+        self.hub.intermediate.connect(self.update_intermediate)
+        self.hub.result.connect(self.show_final_result)
+        self.hub.transfer.connect(self.update_transfer)
+        self.hub.span.connect(self.add_span)
+        self.hub.stage_progress.connect(self.update_stage_progress)
+        self.hub.finished.connect(self.handle_process_finished)
 
     def select_image(self, index):
         """选择图片"""
@@ -462,65 +535,149 @@ class FusionApp(QWidget):
         if path:
             self.image_paths[index] = path
             label = self.findChild(QLabel, "input1" if index == 1 else "input2")
-            pixmap = QPixmap(path).scaled(
-                230, 230,
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
-            label.setPixmap(pixmap)
-            label.setText("")
+            self.show_image(label, path, 230, 230)
             self.log(f"已选择图片{index}: {path.split('/')[-1]}")
 
-    def start_process(self):
-        """启动处理流程"""
-        if not all(self.image_paths.values()):
-            QMessageBox.warning(self, "提示", "请先选择两张图片")
-            return
+    def read_ssh_info(self):
+        """读取服务器信息，未填写完整时返回None"""
         if not all([self.txt_host.text(), self.txt_port.text(), self.txt_pwd.text()]):
             QMessageBox.warning(self, "提示", "请填写完整的服务器信息")
-            return
-
-        ssh_info = {
+            return None
+        return {
             "hostname": self.txt_host.text().strip(),
             "port": int(self.txt_port.text().strip()),
             "username": "root",
             "password": self.txt_pwd.text().strip()
         }
 
-        self.thread = FusionThread(ssh_info, self.image_paths)
-        self.thread.progress.connect(self.log)
-        self.thread.intermediate_ready.connect(self.update_intermediate)
-        self.thread.result_ready.connect(self.show_final_result)
-        self.thread.finished.connect(self.handle_process_finished)
+    def add_server(self):
+        """把填写的服务器加入服务器列表"""
+        ssh_info = self.read_ssh_info()
+        if not ssh_info:
+            return
+        server = ServerState(ssh_info, self.spin_server_jobs.value())
+        self.servers = [s for s in self.servers if s.name != server.name] + [server]
+        # 使用该服务器的单服务器任务也按这个上限排队
+        self.executor.set_host_limit(server.name, server.max_jobs)
+        self.lbl_servers.setText(f"服务器列表: {len(self.servers)} 台")
+        self.log(f"服务器列表加入 {server.name}（并发上限 {server.max_jobs}）")
+
+    def clear_servers(self):
+        """清空服务器列表，恢复使用填写的单台服务器"""
+        for server in self.servers:
+            self.executor.set_host_limit(server.name)
+        self.servers = []
+        self.lbl_servers.setText("服务器列表: 0 台")
+        self.log("已清空服务器列表")
+
+    def read_target(self):
+        """处理目标 (ssh_info, 服务器列表)：列表非空时分发到列表中的服务器，否则使用填写的服务器"""
+        if self.servers:
+            return None, self.servers
+        return self.read_ssh_info(), None
+
+    def start_process(self, start_stage="upload"):
+        """启动处理流程，start_stage之前的步骤复用服务器上仍然有效的结果"""
+        if not all(self.image_paths.values()):
+            QMessageBox.warning(self, "提示", "请先选择两张图片")
+            return
+        ssh_info, servers = self.read_target()
+        if not (ssh_info or servers):
+            return
+        output_dir = None
+        if self.chk_save.isChecked():
+            # 每次任务单独一个目录，多次运行互不覆盖
+            output_dir = os.path.join(JOB_OUTPUT_DIR, time.strftime("%Y%m%d-%H%M%S"))
+            self.log(f"产物保存到 {output_dir}")
+        self.launch_job(
+            ssh_info, [(self.image_paths[1], self.image_paths[2])], output_dir, servers=servers, start_stage=start_stage
+        )
 
-        self.btn_start.setEnabled(False)
-        self.btn_start.setText("处理中...")
+    def start_batch_process(self):
+        """批量处理：选择包含input1/、input2/子目录的文件夹，同名文件组成一组"""
+        ssh_info, servers = self.read_target()
+        if not (ssh_info or servers):
+            return
+        folder = QFileDialog.getExistingDirectory(self, "选择包含input1和input2的文件夹")
+        if not folder:
+            return
+        pairs = collect_pairs(folder)
+        if not pairs:
+            QMessageBox.warning(self, "提示", "input1与input2中没有同名的图片")
+            return
+        output_dir = os.path.join(folder, "fusion_output")
+        self.log(f"批量处理 {len(pairs)} 组图片，结果保存到 {output_dir}")
+        self.launch_job(ssh_info, pairs, output_dir, self.chk_pipeline.isChecked(), servers)
 
-        self.thread.start()
+    def preprocess_options(self):
+        """上传前压缩参数，未勾选时返回None"""
+        if not self.chk_preprocess.isChecked():
+            return None
+        return {"max_size": self.spin_max_size.value(), "quality": self.spin_quality.value()}
+
+    def launch_job(self, ssh_info, pairs, output_dir=None, pipelined=False, servers=None, start_stage="upload"):
+        """把任务记入任务队列，提交给执行器"""
+        if servers and pipelined:
+            self.log("⚠️ 多服务器分发时逐组处理，不使用流水线模式")
+        options = dict(
+            cache=self.result_cache if self.chk_cache.isChecked() else None,
+            use_worker=self.chk_worker.isChecked(),
+            concurrency=self.spin_concurrency.value(),
+            preprocess=self.preprocess_options(),
+            bundle=self.combo_bundle.currentData(),
+            compression=self.combo_compression.currentData(),
+            start_stage=start_stage
+        )
+        journal = queue_job(self.job_queue, ssh_info, pairs, output_dir, pipelined, servers, **options)
+        self.submit_job(
+            journal, ssh_info=ssh_info, pairs=pairs, output_dir=output_dir, pipelined=pipelined, servers=servers,
+            **options
+        )
 
-    def update_intermediate(self, img_type, path):
-        """更新中间产物显示"""
+    def submit_job(self, journal, **arguments):
+        """按create_pipeline的参数创建流程并提交给执行器，图片与传输进度改为显示这个任务"""
+        job_id = journal.job_id
+        if not self.pipelines:
+            self.timing_table.setRowCount(0)
+        self.pipelines[job_id] = create_pipeline(
+            events=self.hub.events(job_id), run_log=self.run_log, journal=journal, **arguments
+        )
+        self.current_job = job_id
+        self.transfer_bar.setValue(0)
+        self.transfer_label.setText("")
+        self.stage_bar.setValue(0)
+        self.stage_bar.setFormat("")
+        self.executor.submit(job_id, self.pipelines[job_id])
+        self.update_job_count()
+
+    def update_job_count(self):
+        """刷新进行中任务数与取消按钮"""
+        running = len(self.executor.jobs())
+        self.lbl_jobs.setText(f"进行中 {running} 个任务" if running else "")
+        self.btn_cancel.setEnabled(bool(self.pipelines))
+
+    def handle_job_started(self, job_id):
+        """任务开始运行"""
+        if len(self.pipelines) > 1:
+            self.log_sink.append("开始执行", job_id=job_id)
+        self.update_job_count()
+
+    def update_intermediate(self, job_id, img_type, source):
+        """更新中间产物显示，source为文件路径或图片内容；只显示当前任务的产物"""
+        if job_id != self.current_job:
+            return
         target_label = self.findChild(QLabel, img_type)
         if target_label:
-            pixmap = QPixmap(path).scaled(
-                target_label.width(),
-                target_label.height(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
-            target_label.setPixmap(pixmap)
+            self.show_image(target_label, source, target_label.width(), target_label.height())
             target_label.setStyleSheet("background-color: #FFF;")
 
-    def show_final_result(self, path):
-        """显示最终结果"""
+    def show_final_result(self, job_id, source):
+        """显示最终结果，source为文件路径或图片内容；只显示当前任务的结果"""
+        if job_id != self.current_job:
+            return
         self.final_label = self.findChild(QLabel, "final_result")
         if self.final_label:
-            pixmap = QPixmap(path).scaled(
-                380, 380,
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
-            self.final_label.setPixmap(pixmap)
+            self.show_image(self.final_label, source, 380, 380)
             self.final_label.setStyleSheet("""
                 QLabel {
                     background-color: #FFF;
@@ -529,30 +686,178 @@ class FusionApp(QWidget):
                 }
             """)
 
-    def handle_process_finished(self, success):
-        """处理完成回调"""
-        self.btn_start.setEnabled(True)
-        self.btn_start.setText("开始融合处理")
+    def show_image(self, label, source, width, height):
+        """在后台按显示尺寸解码图片（路径或bytes），完成后由on_image_loaded显示到label"""
+        self.image_loader.request(label.objectName(), source, width, height, label.devicePixelRatioF())
+
+    def on_image_loaded(self, name, image):
+        """后台解码完成，显示到对应的QLabel"""
+        label = self.findChild(QLabel, name)
+        if label:
+            label.setText("")
+            label.setPixmap(QPixmap.fromImage(image))
+
+    def handle_process_finished(self, job_id, success):
+        """任务完成回调"""
+        pipeline = self.pipelines.pop(job_id, None)
+        self.update_job_count()
+        if pipeline is None or pipeline.cancelled.is_set():
+            return
         if not success:
-            QMessageBox.critical(self, "错误", "处理过程中发生错误，请查看日志")
+            QMessageBox.critical(self, "错误", f"任务 {job_id} 处理过程中发生错误，请查看日志")
+
+    def cancel_process(self):
+        """取消全部任务；终止远程进程需要几次往返，在后台线程中进行"""
+        if self.pipelines:
+            self.btn_cancel.setEnabled(False)
+            threading.Thread(target=self.executor.cancel_all, daemon=True).start()
+
+    def offer_resume(self):
+        """启动时检查任务队列，询问是否继续上次未完成的任务"""
+        jobs = [job for job in self.job_queue.pending() if remaining_pairs(job)]
+        if not jobs:
+            return
+        lines = [
+            f"{time.strftime('%m-%d %H:%M', time.localtime(job.created))}  {len(job.pairs)} 组，"
+            f"上次完成: {job.stage or '无'}"
+            for job in jobs
+        ]
+        answer = QMessageBox.question(
+            self, "继续未完成的任务",
+            f"发现 {len(jobs)} 个未完成的任务，是否从上次完成的步骤继续？\n\n" + "\n".join(lines)
+        )
+        if answer != QMessageBox.StandardButton.Yes:
+            for job in jobs:
+                self.job_queue.abandon(job.job_id)
+            return
+        # 全部交给执行器，按并行任务数与各服务器的名额依次执行
+        for job in jobs:
+            if not self.job_queue.claim(job.job_id):
+                self.log(f"任务 {job.job_id} 已由其他进程继续执行，跳过")
+                continue
+            try:
+                arguments = job_arguments(job, self.password_for, self.result_cache)
+            except LookupError:
+                self.log(f"未输入密码，跳过任务 {job.job_id}")
+                self.job_queue.abandon(job.job_id)
+                continue
+            self.log(f"继续任务 {job.job_id}：{len(arguments['pairs'])} 组图片，上次完成: {job.stage or '无'}")
+            self.submit_job(self.job_queue.journal(job.job_id), **arguments)
+
+    def password_for(self, name):
+        """恢复任务时服务器的密码：服务器列表或输入框中有则直接使用，否则询问"""
+        for server in self.servers:
+            if server.name == name:
+                return server.ssh_info["password"]
+        if name == f"{self.txt_host.text().strip()}:{self.txt_port.text().strip()}" and self.txt_pwd.text():
+            return self.txt_pwd.text().strip()
+        password, ok = QInputDialog.getText(
+            self, "服务器密码", f"{name} 的密码:", QLineEdit.EchoMode.Password
+        )
+        if not ok or not password:
+            raise LookupError(name)
+        return password
 
-    def log(self, message):
-        """记录日志"""
-        timestamp = time.strftime("%H:%M:%S")
-        self.log_area.append(f"[{timestamp}] {message}")
-        self.log_area.verticalScrollBar().setValue(
-            self.log_area.verticalScrollBar().maximum()
+    def update_transfer(self, job_id, stats):
+        """刷新传输进度条，只显示当前任务"""
+        if job_id != self.current_job:
+            return
+        self.transfer_bar.setValue(int(stats.done * 1000 / stats.total) if stats.total else 0)
+        text = (
+            f"{format_size(stats.done)} / {format_size(stats.total)}  "
+            f"{format_size(stats.rate)}/s（平均 {format_size(stats.average)}/s）"
         )
+        if stats.eta >= 0:
+            text += f"  剩余 {stats.eta:.0f} 秒"
+        self.transfer_label.setText(text)
+
+    def update_stage_progress(self, job_id, stage, done, total):
+        """刷新阶段进度条，只显示当前任务"""
+        if job_id != self.current_job:
+            return
+        self.stage_bar.setRange(0, total)
+        self.stage_bar.setValue(done)
+        self.stage_bar.setFormat(f"{stage} {done}/{total}")
+
+    def add_span(self, job_id, span):
+        """在耗时明细中追加一个步骤"""
+        row = self.timing_table.rowCount()
+        self.timing_table.insertRow(row)
+        values = [
+            job_id[:6],
+            "合计" if span.stage == "job" else span.stage,
+            "" if span.index is None else str(span.index),
+            f"{span_duration(span):.2f}",
+            format_size(span.bytes) if span.bytes else "",
+            "" if span.exit_status is None else str(span.exit_status),
+        ]
+        for column, value in enumerate(values):
+            item = QTableWidgetItem(value)
+            item.setToolTip(f"任务 {job_id}  {span.server}")
+            if not span.ok:
+                item.setForeground(Qt.GlobalColor.red)
+            self.timing_table.setItem(row, column, item)
+        self.timing_table.scrollToBottom()
+
+    def log(self, message):
+        """记录日志，由flush_log定时显示"""
+        self.log_sink.append(message)
+
+    def show_entry(self, entry):
+        """日志是否达到当前显示级别"""
+        return LEVELS.index(entry.level) >= LEVELS.index(self.combo_log_level.currentData())
+
+    def format_log(self, entry):
+        """日志的显示文本，同时有多个任务时加上任务ID前缀"""
+        prefix = f"[{entry.job_id[:6]}] " if entry.job_id and len(self.pipelines) > 1 else ""
+        return format_entry(entry, prefix)
+
+    def flush_log(self):
+        """把上次刷新以来的日志一次追加到日志区；用户向上翻看时不自动滚动"""
+        entries, dropped = self.log_sink.drain()
+        lines = [self.format_log(entry) for entry in entries if self.show_entry(entry)]
+        if dropped:
+            lines.insert(0, f"…… 日志过多，省略 {dropped} 条，完整记录见 {self.log_sink.spill_path}")
+        if not lines:
+            return
+        # 超出日志区容量的部分追加后也会被立即挤掉
+        lines = lines[-MAX_LOG_LINES:]
+        bar = self.log_area.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum() - 4
+        self.log_area.appendPlainText("\n".join(lines))
+        if at_bottom:
+            bar.setValue(bar.maximum())
+
+    def refilter_log(self):
+        """显示级别改变后，按新的级别重新显示内存中保留的日志"""
+        self.flush_log()
+        entries = self.log_sink.history(self.combo_log_level.currentData())[-MAX_LOG_LINES:]
+        self.log_area.setPlainText("\n".join(self.format_log(entry) for entry in entries))
+        self.log_area.verticalScrollBar().setValue(self.log_area.verticalScrollBar().maximum())
 
     def closeEvent(self, event):
         """关闭窗口事件"""
-        if self.thread and self.thread.isRunning():
-            self.thread.terminate()
-            self.thread.wait()
+        if self.pipelines:
+            # 先终止服务器上的进程，任务留在队列中，下次启动时可以继续
+            self.executor.cancel_all(keep_pending=True)
+            self.executor.wait(30)
+        shared_pool.close_all()
+        self.log_sink.close()
         event.accept()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    startup.mark("创建QApplication")
     window = FusionApp()
     window.show()
+    app.processEvents()
+    startup.mark("首次显示")
+    if "--profile-startup" in sys.argv:
+        # 只统计启动耗时：输出明细后退出，超出预算时返回非零状态
+        report, within = startup.report("gui5")
+        print(report)
+        sys.exit(0 if within else 1)
+    # 窗口显示后再在后台导入paramiko，第一次连接时不必等待
+    preload()
+    QTimer.singleShot(0, window.offer_resume)
     sys.exit(app.exec())
@@ -0,0 +1,98 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from PyQt6.QtGui import QImage, QImageReader, QImageIOHandler
+from PyQt6.QtCore import Qt, QObject, QThreadPool, QBuffer, QByteArray, QIODevice, pyqtSignal
+
+DEFAULT_CACHE_BYTES = 64 << 20
+
+
+# ============================================================
+#                        后台图片解码
+# ============================================================
+class ImageLoader(QObject):
+    """在后台线程按显示尺寸直接解码图片，经loaded信号把QImage送回界面线程
+
+    QImageReader.setScaledSize让解码器直接输出缩略图大小的图像，不必先解出整幅全景图。
+    图片来源可以是文件路径，也可以是内存中的图片内容（bytes）。
+    解码结果按 (路径与修改时间或内容哈希, 目标尺寸, 设备像素比) 放入LRU缓存，超出容量淘汰最久未用的。
+    同一标签（通常是QLabel的objectName）只交付最后一次请求的结果。
+    """
+
+    loaded = pyqtSignal(str, QImage)  # (标签, 图像)
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, threads=2, parent=None):
+        super().__init__(parent)
+        self.max_bytes = max_bytes
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(threads)
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # {键: QImage}
+        self.cache_bytes = 0
+        self.latest = {}  # {标签: 最后一次请求的键}
+
+    def request(self, tag, source, width, height, dpr=1.0):
+        """请求把source（路径或bytes）解码为不超过width×height（逻辑像素）的图像"""
+        if isinstance(source, bytes):
+            identity = hashlib.blake2b(source, digest_size=16).hexdigest()
+        else:
+            try:
+                st = os.stat(source)
+            except OSError:
+                return
+            identity = (os.path.abspath(source), st.st_mtime_ns, st.st_size)
+        key = (identity, width, height, dpr)
+        with self.lock:
+            self.latest[tag] = key
+            image = self.cache.get(key)
+            if image is not None:
+                self.cache.move_to_end(key)
+        if image is not None:
+            self.loaded.emit(tag, image)
+            return
+        self.pool.start(lambda: self.decode(tag, key, source))
+
+    def decode(self, tag, key, source):
+        """在线程池中解码并交付"""
+        _, width, height, dpr = key
+        image = read_scaled(source, round(width * dpr), round(height * dpr))
+        if image.isNull():
+            return
+        image.setDevicePixelRatio(dpr)
+        with self.lock:
+            self.store(key, image)
+            current = self.latest.get(tag) == key
+        if current:
+            self.loaded.emit(tag, image)
+
+    def store(self, key, image):
+        """放入缓存并按容量淘汰（调用方持有锁）"""
+        if key in self.cache:
+            return
+        self.cache[key] = image
+        self.cache_bytes += image.sizeInBytes()
+        while self.cache_bytes > self.max_bytes and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted.sizeInBytes()
+
+
+def read_scaled(source, width, height):
+    """按EXIF方向解码，长宽不超过width×height像素，保持比例"""
+    if isinstance(source, bytes):
+        buffer = QBuffer()
+        buffer.setData(QByteArray(source))
+        buffer.open(QIODevice.OpenModeFlag.ReadOnly)
+        reader = QImageReader(buffer)
+    else:
+        reader = QImageReader(source)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid():
+        # 缩放尺寸作用于旋转前的图像，旋转90°的照片需交换目标框的宽高
+        if reader.transformation() & QImageIOHandler.Transformation.TransformationRotate90:
+            width, height = height, width
+        target = size.scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio)
+        if target.width() < size.width():
+            reader.setScaledSize(target)
+    return reader.read()
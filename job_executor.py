@@ -0,0 +1,165 @@
+import threading
+from dispatcher import Dispatcher
+
+
+def pipeline_hosts(pipeline):
+    """流程会用到的服务器（主机:端口）列表"""
+    if isinstance(pipeline, Dispatcher):
+        return [server.name for server in pipeline.servers]
+    return [pipeline.server_id()]
+
+
+class ExecutorEvents:
+    """执行器回调接口，默认什么也不做；回调在执行任务的线程中调用"""
+
+    def on_job_started(self, job_id):
+        pass
+
+    def on_job_finished(self, job_id, ok):
+        pass
+
+
+# ============================================================
+#                        任务执行器
+# ============================================================
+class JobExecutor:
+    """并发执行多个融合任务：同时运行的任务数不超过max_workers，每台服务器上同时运行的任务数不超过host_limit
+
+    提交的任务按提交顺序排队，有空闲名额且所用服务器都有余量时启动，一个任务在等服务器时不挡住后面用其他服务器的任务。
+    各任务在服务器上有独立的工作空间，host_limit只用来限制同一块GPU上同时推理的任务数，
+    与分发器中每台服务器的默认并发上限一致，默认为1（租用的单卡同时推理两组容易显存不足）；
+    多服务器分发的任务占用列表中的全部服务器，各服务器上的组数由分发器按列表中的并发上限控制。
+    """
+
+    def __init__(self, max_workers=4, host_limit=1, events=None):
+        self.max_workers = max_workers
+        self.host_limit = host_limit
+        self.host_limits = {}  # {主机:端口: 并发上限}，未列出的服务器使用host_limit
+        self.events = events or ExecutorEvents()
+        self.condition = threading.Condition()
+        self.waiting = []  # [(job_id, pipeline, hosts), ...]
+        self.running = {}  # {job_id: (pipeline, hosts, thread)}
+        self.host_jobs = {}  # {主机:端口: 运行中的任务数}
+        self.cancelling = set()  # 正在取消（等待GPU释放）的任务ID
+        self.held = {}  # {job_id: hosts}，已结束但取消尚未确认GPU释放、仍占着服务器名额的任务
+
+    def submit(self, job_id, pipeline):
+        """提交任务，返回job_id；pipeline为FusionPipeline、PipelinedFusion或Dispatcher"""
+        with self.condition:
+            if job_id in self.running or any(job[0] == job_id for job in self.waiting):
+                raise ValueError(f"任务 {job_id} 已在执行器中")
+            self.waiting.append((job_id, pipeline, pipeline_hosts(pipeline)))
+            self.schedule()
+        return job_id
+
+    def set_max_workers(self, max_workers):
+        """修改同时运行的任务数上限，调大时立即启动排队中的任务"""
+        with self.condition:
+            self.max_workers = max_workers
+            self.schedule()
+
+    def set_host_limit(self, host, limit=None):
+        """修改一台服务器（主机:端口）上同时运行的任务数上限，limit为None时恢复默认的host_limit"""
+        with self.condition:
+            if limit is None:
+                self.host_limits.pop(host, None)
+            else:
+                self.host_limits[host] = limit
+            self.schedule()
+
+    def jobs(self):
+        """排队中与运行中的任务ID"""
+        with self.condition:
+            return [job[0] for job in self.waiting] + list(self.running)
+
+    def pipeline(self, job_id):
+        """任务对应的流程，任务已结束时返回None"""
+        with self.condition:
+            if job_id in self.running:
+                return self.running[job_id][0]
+            return next((job[1] for job in self.waiting if job[0] == job_id), None)
+
+    def cancel(self, job_id, keep_pending=False):
+        """取消任务：排队中的直接移除，运行中的终止远程进程（阻塞至确认GPU释放），返回是否已确认释放"""
+        with self.condition:
+            waiting = next((job for job in self.waiting if job[0] == job_id), None)
+            if waiting is not None:
+                self.waiting.remove(waiting)
+            pipeline = self.running[job_id][0] if job_id in self.running else None
+        if waiting is not None:
+            # 没有开始运行，keep_pending时任务留在任务队列中，下次启动时再执行
+            waiting[1].cancelled.set()
+            if not keep_pending:
+                waiting[1].journal.finish(False, "已取消")
+            self.events.on_job_finished(job_id, False)
+            return True
+        if pipeline is None:
+            return True
+        with self.condition:
+            self.cancelling.add(job_id)
+        try:
+            return pipeline.cancel(keep_pending=keep_pending)
+        finally:
+            # 任务在取消期间已经结束时，直到确认GPU释放才让出服务器名额
+            with self.condition:
+                self.cancelling.discard(job_id)
+                hosts = self.held.pop(job_id, None)
+                if hosts is not None:
+                    self.release_hosts(hosts)
+
+    def cancel_all(self, keep_pending=False):
+        """取消全部任务，运行中的任务并行取消，返回是否全部确认GPU已释放"""
+        with self.condition:
+            job_ids = [job[0] for job in self.waiting] + list(self.running)
+        results = []
+        threads = [
+            threading.Thread(target=lambda job_id=job_id: results.append(self.cancel(job_id, keep_pending)))
+            for job_id in job_ids
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return all(results)
+
+    def wait(self, timeout=None):
+        """等待全部任务结束，超时返回False"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not (self.waiting or self.running or self.held), timeout)
+
+    def schedule(self):
+        """按提交顺序启动可以运行的任务，调用时需持有condition"""
+        for job in list(self.waiting):
+            if len(self.running) >= self.max_workers:
+                break
+            job_id, pipeline, hosts = job
+            if any(self.host_jobs.get(host, 0) >= self.host_limits.get(host, self.host_limit) for host in hosts):
+                continue
+            self.waiting.remove(job)
+            for host in hosts:
+                self.host_jobs[host] = self.host_jobs.get(host, 0) + 1
+            thread = threading.Thread(target=self.run_job, args=(job_id, pipeline), daemon=True)
+            self.running[job_id] = (pipeline, hosts, thread)
+            thread.start()
+
+    def run_job(self, job_id, pipeline):
+        """在独立线程中运行一个任务，结束后释放服务器名额并调度后续任务（正在取消的任务等取消完成后再释放）"""
+        ok = False
+        try:
+            self.events.on_job_started(job_id)
+            ok = pipeline.run()
+        finally:
+            with self.condition:
+                _, hosts, _ = self.running.pop(job_id)
+                if job_id in self.cancelling:
+                    self.held[job_id] = hosts
+                else:
+                    self.release_hosts(hosts)
+            self.events.on_job_finished(job_id, ok)
+
+    def release_hosts(self, hosts):
+        """让出服务器名额并调度后续任务，调用时需持有condition"""
+        for host in hosts:
+            self.host_jobs[host] -= 1
+        self.schedule()
+        self.condition.notify_all()
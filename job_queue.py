@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from collections import namedtuple
+
+DEFAULT_JOB_DB = os.path.join(os.path.expanduser("~"), ".cache", "udis2", "jobs.db")
+
+# 顺序模式下依次完成的步骤；stage记录最后一个完成的步骤
+STAGES = ["upload", "warp", "composition", "download"]
+
+# 一个任务的记录：servers为 [{"hostname", "port", "username", "max_jobs"}, ...]（不保存密码），
+# mode为 "sequential"、"pipelined" 或 "dispatch"，done_pairs为已取回最终结果的组，
+# owner为正在执行（或排队执行）该任务的进程 "主机名:PID"
+Job = namedtuple("Job", [
+    "job_id", "servers", "pairs", "output_dir", "mode", "options",
+    "status", "stage", "done_pairs", "error", "created", "updated", "owner"
+])
+
+
+def current_owner():
+    """本进程的标识：主机名:PID"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_alive(owner):
+    """记录的进程是否仍在运行；其他主机上的进程无法确认，按仍在运行处理"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        # 没有权限发信号说明进程存在
+        return True
+    return True
+
+
+def remaining_pairs(job):
+    """恢复任务时需要处理的组
+
+    顺序模式有步骤检查点时保留全部组（服务器上按组序号编号，删掉已完成的组会对不上），
+    其余情况跳过已取回结果的组。
+    """
+    if job.mode == "sequential" and job.stage:
+        return job.pairs
+    done = {tuple(pair) for pair in job.done_pairs}
+    return [pair for pair in job.pairs if pair not in done]
+
+
+# ============================================================
+#                        任务进度记录
+# ============================================================
+class JobJournal:
+    """流程向任务队列报告进度的接口；这个基类什么也不记录，供不入队的任务使用"""
+
+    job_id = None
+    stage = None  # 恢复时上次最后完成的步骤
+
+    def running(self):
+        """任务开始执行"""
+
+    def stage_done(self, stage):
+        """顺序模式下一个步骤完成"""
+
+    def pair_done(self, pair):
+        """一组的最终结果已取回"""
+
+    def finish(self, ok, error=None):
+        """任务结束"""
+
+
+class StoredJournal(JobJournal):
+    """把一个任务的进度写入JobQueue"""
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job_id = job.job_id
+        self.stage = job.stage
+
+    def running(self):
+        self.queue.update(self.job_id, status="running")
+
+    def stage_done(self, stage):
+        self.stage = stage
+        self.queue.update(self.job_id, stage=stage)
+
+    def pair_done(self, pair):
+        self.queue.add_done_pair(self.job_id, pair)
+
+    def finish(self, ok, error=None):
+        self.queue.update(self.job_id, status="done" if ok else "failed", error=error)
+
+
+# ============================================================
+#                        任务队列
+# ============================================================
+class JobQueue:
+    """SQLite中的任务队列：记录每个任务的输入、最后完成的步骤与已完成的组，程序崩溃或重启后可以接着执行
+
+    每次状态变化都在一个事务中提交，进程在任意时刻退出，库中都是某个步骤完成后的一致状态。
+    状态为queued或running、且记录的进程已经退出的任务，说明上次运行中途退出，可以恢复；
+    记录的进程仍在运行时（例如界面与命令行同时使用任务队列）由它继续执行，其他进程不会重复执行。
+    """
+
+    def __init__(self, path=DEFAULT_JOB_DB):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        # WAL模式：界面与命令行可以同时读写同一个库
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, servers TEXT NOT NULL, pairs TEXT NOT NULL, output_dir TEXT,"
+                "mode TEXT NOT NULL, options TEXT NOT NULL, status TEXT NOT NULL, stage TEXT,"
+                "done_pairs TEXT NOT NULL DEFAULT '[]', error TEXT,"
+                "created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_status ON jobs(status)")
+            columns = [row[1] for row in self.db.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                # 旧版本建的库
+                self.db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def add(self, servers, pairs, output_dir, mode, options):
+        """新建任务，返回任务ID；servers中的密码不会保存"""
+        job_id = uuid.uuid4().hex[:12]
+        servers = [
+            {key: value for key, value in server.items() if key != "password"}
+            for server in servers
+        ]
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO jobs (job_id, servers, pairs, output_dir, mode, options, status, created, updated, owner)"
+                " VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, json.dumps(servers), json.dumps(pairs), output_dir, mode,
+                 json.dumps(options), now, now, current_owner())
+            )
+        return job_id
+
+    def get(self, job_id):
+        """读取任务，不存在时返回None"""
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(Job._fields)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_job(row) if row else None
+
+    def pending(self):
+        """上次运行中途退出、可以恢复的任务（排除仍由其他进程或本进程执行的），按创建时间排序"""
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT {', '.join(Job._fields)} FROM jobs"
+                " WHERE status IN ('queued', 'running') ORDER BY created"
+            ).fetchall()
+        return [job for job in map(self._to_job, rows) if not owner_alive(job.owner)]
+
+    def claim(self, job_id):
+        """由本进程接手任务，记录的进程仍在运行时返回False
+
+        检查与改写在同一个写事务中进行，两个进程同时恢复同一个任务时只有一个能接手。
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute("SELECT owner FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None or (row[0] != current_owner() and owner_alive(row[0])):
+                    self.db.rollback()
+                    return False
+                self.db.execute(
+                    "UPDATE jobs SET owner = ?, updated = ? WHERE job_id = ?", (current_owner(), time.time(), job_id)
+                )
+                self.db.commit()
+                return True
+            except Exception:
+                self.db.rollback()
+                raise
+
+    def journal(self, job_id):
+        """任务的进度记录对象，交给流程使用"""
+        return StoredJournal(self, self.get(job_id))
+
+    def update(self, job_id, **fields):
+        """更新任务的status、stage、error字段"""
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock, self.db:
+            self.db.execute(
+                f"UPDATE jobs SET {assignments}, updated = ? WHERE job_id = ?",
+                (*fields.values(), time.time(), job_id)
+            )
+
+    def add_done_pair(self, job_id, pair):
+        """记录一组已完成"""
+        with self.lock, self.db:
+            row = self.db.execute("SELECT done_pairs FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            done = json.loads(row[0])
+            if list(pair) not in done:
+                done.append(list(pair))
+            self.db.execute(
+                "UPDATE jobs SET done_pairs = ?, updated = ? WHERE job_id = ?",
+                (json.dumps(done), time.time(), job_id)
+            )
+
+    def abandon(self, job_id):
+        """放弃恢复一个任务；任务已被其他进程接手时不做改动"""
+        if self.claim(job_id):
+            self.update(job_id, status="abandoned")
+
+    @staticmethod
+    def _to_job(row):
+        values = dict(zip(Job._fields, row))
+        for name in ["servers", "options", "done_pairs"]:
+            values[name] = json.loads(values[name])
+        values["pairs"] = [tuple(pair) for pair in json.loads(values["pairs"])]
+        return Job(**values)
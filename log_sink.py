@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+from collections import deque, namedtuple
+
+DEFAULT_LOG_DIR = os.path.join(os.path.expanduser("~"), ".cache", "udis2", "logs")
+
+# 日志级别，由低到高；debug为服务器脚本的原始输出
+LEVELS = ["debug", "info", "warning", "error"]
+
+# 一条日志：time为time.time()，job_id为产生该日志的任务（界面自身的日志为None）
+LogEntry = namedtuple("LogEntry", ["time", "level", "job_id", "message"])
+
+
+def message_level(message):
+    """按消息中的标记推断级别"""
+    if "❌" in message:
+        return "error"
+    if "⚠️" in message:
+        return "warning"
+    return "info"
+
+
+def format_entry(entry, prefix=""):
+    """格式化为一行文本"""
+    return f"[{time.strftime('%H:%M:%S', time.localtime(entry.time))}] {prefix}{entry.message}"
+
+
+# ============================================================
+#                        日志缓冲
+# ============================================================
+class LogBuffer:
+    """线程安全的日志缓冲：任何线程都可以append，界面定时drain取走新日志批量显示
+
+    最近max_entries条保留在内存中（切换级别过滤时重新显示），两次drain之间最多积压pending_limit条，
+    超出时丢弃最早的并计数。给出spill_path时全部日志同时写入该文件，不受上述上限影响。
+    """
+
+    def __init__(self, max_entries=20000, pending_limit=5000, spill_path=None):
+        self.lock = threading.Lock()
+        self.entries = deque(maxlen=max_entries)
+        self.pending = deque(maxlen=pending_limit)
+        self.dropped = 0
+        self.spill_path = spill_path
+        self.spill = None
+        if spill_path:
+            if os.path.dirname(spill_path):
+                os.makedirs(os.path.dirname(spill_path), exist_ok=True)
+            self.spill = open(spill_path, "a", encoding="utf-8", buffering=1 << 16)
+
+    def append(self, message, level=None, job_id=None):
+        """追加一条日志，level为None时按消息内容推断"""
+        entry = LogEntry(time.time(), level or message_level(message), job_id, message)
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.entries.append(entry)
+            self.pending.append(entry)
+            if self.spill:
+                stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.time))
+                prefix = f"[{job_id}] " if job_id else ""
+                self.spill.write(f"{stamp} {entry.level.upper():<7} {prefix}{message}\n")
+
+    def drain(self):
+        """取走上次drain之后的新日志，返回 (日志列表, 因积压被丢弃的条数)"""
+        with self.lock:
+            entries, dropped = list(self.pending), self.dropped
+            self.pending.clear()
+            self.dropped = 0
+            if self.spill:
+                self.spill.flush()
+        return entries, dropped
+
+    def history(self, min_level="debug"):
+        """内存中保留的、不低于min_level的日志"""
+        threshold = LEVELS.index(min_level)
+        with self.lock:
+            return [entry for entry in self.entries if LEVELS.index(entry.level) >= threshold]
+
+    def close(self):
+        with self.lock:
+            if self.spill:
+                self.spill.close()
+                self.spill = None
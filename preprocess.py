@@ -0,0 +1,34 @@
+import io
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+
+def is_jpeg(path):
+    """按文件头判断是否为JPEG（不看扩展名）"""
+    with open(path, "rb") as f:
+        return f.read(3) == JPEG_MAGIC
+
+
+def encode_jpeg(path, max_size=None, quality=95):
+    """在内存中按EXIF方向摆正、限制最长边并重新编码为JPEG，返回bytes"""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        img = ImageOps.exif_transpose(img)
+        if max_size and max(img.size) > max_size:
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def prepare_upload(path, options=None):
+    """上传前预处理：options为 {"max_size": 最长边, "quality": JPEG质量} 时按其压缩；
+    未启用预处理时JPEG原样上传（返回None），其他格式转成真正的JPEG"""
+    if options:
+        return encode_jpeg(path, options.get("max_size"), options.get("quality", 95))
+    if is_jpeg(path):
+        return None
+    return encode_jpeg(path)
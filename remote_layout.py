@@ -0,0 +1,247 @@
+from collections import namedtuple
+
+# ============================================================
+#                        服务器目录布局
+# ============================================================
+REMOTE_PYTHON = "/root/miniconda3/bin/python"
+UDIS2_DIR = "autodl-tmp/UDIS2-main"
+COMPOSITION_DIR = f"{UDIS2_DIR}/Composition"
+
+# 每个任务在服务器上有独立的工作空间 WORKSPACE_ROOT/<任务ID>/，同一台服务器上的任务互不干扰
+WORKSPACE_ROOT = "autodl-tmp/UDIS-D/jobs"
+# 工作空间最后一次使用（.lease的修改时间）超过这么多小时、且没有在运行的进程时被清理
+WORKSPACE_TTL_HOURS = 48
+
+# 以下目录都相对于工作空间根目录，沿用UDIS2脚本的约定：变形脚本读写 --test_path 下的
+# input1/2、warp1/2、mask1/2，合成脚本从 --test_path 读取变形产物，把结果写到工作目录上一级
+TESTING_DIR = "testing"
+ARTIFACT_DIRS = {
+    "warp1": f"{TESTING_DIR}/warp1",
+    "warp2": f"{TESTING_DIR}/warp2",
+    "mask1": f"{TESTING_DIR}/mask1",
+    "mask2": f"{TESTING_DIR}/mask2",
+    "learn_mask1": "Composition/learn_mask1",
+    "learn_mask2": "Composition/learn_mask2",
+    "composition": "Composition/composition",
+}
+WARP_ARTIFACTS = ["warp1", "warp2", "mask1", "mask2"]
+COMPOSITION_ARTIFACTS = ["learn_mask1", "learn_mask2", "composition"]
+# 下载到本地展示的产物
+FETCHED_ARTIFACTS = WARP_ARTIFACTS + COMPOSITION_ARTIFACTS
+
+# 各阶段脚本（相对于服务器家目录）及其工作目录（相对于工作空间）
+RemoteStage = namedtuple("RemoteStage", ["script", "cwd"])
+WARP_STAGE = RemoteStage(f"{UDIS2_DIR}/Warp/Codes/test_output.py", "")
+COMPOSITION_STAGE = RemoteStage(f"{COMPOSITION_DIR}/Codes/test.py", "Composition/Codes")
+
+# 常驻推理进程脚本的上传位置
+WORKER_PATH = "autodl-tmp/udis_worker.py"
+
+# 阶段进程与常驻进程都在独立的进程组中运行，组ID记录在这里，取消任务时按组终止
+PID_DIR = "autodl-tmp/UDIS-D/pids"
+WORKER_PID_NAME = "worker"
+# 列出占用GPU的进程PID，没有nvidia-smi时输出为空
+GPU_APPS_COMMAND = "nvidia-smi --query-compute-apps=pid --format=csv,noheader 2>/dev/null || true"
+
+
+
+def fingerprint_command(dirs):
+    """模型指纹：dirs下模型权重与代码的路径、大小、修改时间的哈希"""
+    return (
+        f"find {' '.join(f'~/{d}' for d in dirs)} -type f \\( -name '*.pth' -o -name '*.py' \\)"
+        " -printf '%p %s %T@\\n' 2>/dev/null | sort | sha256sum | cut -d' ' -f1"
+    )
+
+
+# 整个模型的指纹，权重更新后本地缓存自动失效
+FINGERPRINT_COMMAND = fingerprint_command([f"{UDIS2_DIR}/Warp", COMPOSITION_DIR])
+
+# 按内容哈希保存的上传图片
+CAS_DIR = "autodl-tmp/UDIS-D/cas"
+
+# 流水线模式：上传暂存区与每组产物的结果区（相对于工作空间）
+STAGING_DIR = "staging"
+RESULTS_DIR = "results"
+
+
+# 步骤检查点（相对于工作空间）：顺序模式下每个步骤完成后写入 "<输入摘要> <该步骤的模型指纹>"，
+# 清理该步骤的目录时一并删除；输入与模型都没变、产物仍在的步骤可以直接复用
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_STAGES = ["upload", "warp", "composition"]
+# 各步骤结果依赖的模型目录（上传不依赖模型）
+STAGE_MODEL_DIRS = {"upload": [], "warp": [f"{UDIS2_DIR}/Warp"], "composition": [COMPOSITION_DIR]}
+
+
+def pair_name(index):
+    """第index组图片（从1开始）在服务器上的文件名"""
+    return f"{index:06d}.jpg"
+
+
+def pid_path(name):
+    """进程组ID文件路径"""
+    return f"{PID_DIR}/{name}.pid"
+
+
+def cancel_path(name):
+    """取消标记文件路径：存在时以该名称启动的进程组直接退出"""
+    return f"{PID_DIR}/{name}.cancel"
+
+
+def process_group_command(command, pid_name):
+    """在新的进程组（setsid）中运行command并等待结束，运行期间把组ID写入pid文件，退出码不变
+
+    先写pid文件再检查取消标记：取消方先写标记再读pid文件，两者总有一方能看到对方，
+    不会出现取消时还没有进程组、取消后阶段却照常运行的情况。
+    退出时只删除仍是自己的pid文件，不会删掉之后同名进程组写入的。
+    """
+    pid = f"~/{pid_path(pid_name)}"
+    return (
+        f"mkdir -p ~/{PID_DIR} && setsid -w sh -c '"
+        f"echo $$ > {pid}; if [ -f ~/{cancel_path(pid_name)} ]; then rm -f {pid}; exit 130; fi; "
+        f"{command}; code=$?; [ \"$(cat {pid} 2>/dev/null)\" = $$ ] && rm -f {pid}; exit $code'"
+    )
+
+
+def mark_cancelled_command(pid_name):
+    """写入取消标记，此后以该名称启动的进程组不再运行"""
+    return f"mkdir -p ~/{PID_DIR} && touch ~/{cancel_path(pid_name)}"
+
+
+def kill_group_command(pid_name, grace=5):
+    """终止pid文件记录的进程组：先发SIGTERM，grace秒内未退出再发SIGKILL
+
+    输出组内各进程的PID，供确认GPU是否释放；没有正在运行的进程组时什么也不输出。
+    """
+    pid = f"~/{pid_path(pid_name)}"
+    return (
+        f"[ -f {pid} ] || exit 0; pgid=$(cat {pid}); pgrep -g $pgid; "
+        f"kill -TERM -- -$pgid 2>/dev/null; "
+        f"for i in $(seq {int(grace * 10)}); do kill -0 -- -$pgid 2>/dev/null || break; sleep 0.1; done; "
+        f"kill -KILL -- -$pgid 2>/dev/null; [ \"$(cat {pid} 2>/dev/null)\" = \"$pgid\" ] && rm -f {pid}; true"
+    )
+
+
+def stage_fingerprint_command(stage):
+    """输出步骤模型指纹的命令，不依赖模型的步骤输出 -"""
+    dirs = STAGE_MODEL_DIRS[stage]
+    return fingerprint_command(dirs) if dirs else "echo -"
+
+
+# 工作空间中需要预先建好的目录
+WORKSPACE_DIRS = [
+    f"{TESTING_DIR}/input1", f"{TESTING_DIR}/input2", *ARTIFACT_DIRS.values(),
+    COMPOSITION_STAGE.cwd, STAGING_DIR, RESULTS_DIR, CHECKPOINT_DIR,
+]
+
+
+# ============================================================
+#                        任务工作空间
+# ============================================================
+class Workspace:
+    """一个任务在服务器上的工作空间，给出其中各文件的路径（相对于服务器家目录）与相关命令"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.root = f"{WORKSPACE_ROOT}/{job_id}"
+
+    def path(self, relative):
+        """工作空间内的路径"""
+        return f"{self.root}/{relative}"
+
+    def artifact_dir(self, kind):
+        """产物所在目录"""
+        return self.path(ARTIFACT_DIRS[kind])
+
+    def input_dir(self, slot):
+        """输入图片目录，slot为1或2"""
+        return self.path(f"{TESTING_DIR}/input{slot}")
+
+    def input_path(self, slot, index):
+        """输入图片路径"""
+        return f"{self.input_dir(slot)}/{pair_name(index)}"
+
+    def artifact_path(self, kind, index):
+        """产物路径"""
+        return f"{self.artifact_dir(kind)}/{pair_name(index)}"
+
+    def staged_input_path(self, slot, index):
+        """流水线模式下第index组输入图片的暂存路径"""
+        return self.path(f"{STAGING_DIR}/{index:06d}/input{slot}.jpg")
+
+    def result_path(self, kind, index):
+        """流水线模式下第index组产物在结果区的路径"""
+        return self.path(f"{RESULTS_DIR}/{index:06d}/{kind}.jpg")
+
+    def checkpoint_path(self, stage):
+        """步骤检查点文件路径"""
+        return self.path(f"{CHECKPOINT_DIR}/{stage}")
+
+    def stage_args(self):
+        """让阶段脚本读写本工作空间的参数"""
+        return ["--test_path", f"~/{self.path(TESTING_DIR)}/"]
+
+    def stage_command(self, stage):
+        """以独立Python进程执行阶段脚本的命令，进程组ID记录在以任务ID命名的pid文件中"""
+        command = f"{REMOTE_PYTHON} ~/{stage.script} {' '.join(self.stage_args())}"
+        return f"cd ~/{self.path(stage.cwd)} && touch ~/{self.root}/.lease && {process_group_command(command, self.job_id)}"
+
+    def create_command(self):
+        """创建工作空间：在临时目录中建好全部子目录后一次改名，其他进程看不到建了一半的工作空间；已存在时只更新使用时间"""
+        temp = f"~/{WORKSPACE_ROOT}/.tmp-{self.job_id}-$$"
+        dirs = " ".join(f"{temp}/{d}" for d in WORKSPACE_DIRS)
+        return (
+            f"if [ ! -d ~/{self.root} ]; then mkdir -p {dirs} && touch {temp}/.lease"
+            f" && {{ mv -T {temp} ~/{self.root} 2>/dev/null || rm -rf {temp}; }}; fi"
+            f" && touch ~/{self.root}/.lease"
+        )
+
+    def clear_command(self, kinds):
+        """清空kinds各产物目录的命令"""
+        return " && ".join(f"rm -rf ~/{self.artifact_dir(kind)}/*" for kind in kinds)
+
+    def clear_checkpoints_command(self, stage):
+        """删除stage及其之后各步骤检查点的命令"""
+        stages = CHECKPOINT_STAGES[CHECKPOINT_STAGES.index(stage):]
+        return "rm -f " + " ".join(f"~/{self.checkpoint_path(s)}" for s in stages)
+
+    def seed_command(self, digest):
+        """工作空间还没有上传检查点时，从最近一个输入摘要相同的工作空间复制结果，输出来源目录
+
+        输入与产物用硬链接（各步骤总是先删除旧产物再写入，不会改到来源），检查点复制为独立的文件。
+        """
+        root = f"~/{self.root}"
+        data = " ".join(f"$src/{d}" for d in sorted({d.split("/")[0] for d in ARTIFACT_DIRS.values()}))
+        return (
+            f"[ -f {root}/{CHECKPOINT_DIR}/upload ] && exit 0; "
+            f"for f in $(ls -t ~/{WORKSPACE_ROOT}/*/{CHECKPOINT_DIR}/upload 2>/dev/null); do "
+            f"src=${{f%/{CHECKPOINT_DIR}/upload}}; [ $src = {root} ] && continue; "
+            f"grep -q '^{digest} ' $f || continue; "
+            f"cp -alf {data} {root}/ && cp -pf $src/{CHECKPOINT_DIR}/* {root}/{CHECKPOINT_DIR}/ && echo $src; break; done; true"
+        )
+
+    def remove_command(self):
+        """删除整个工作空间的命令"""
+        return f"rm -rf ~/{self.root}"
+
+
+def collect_workspaces_command(ttl_hours=WORKSPACE_TTL_HOURS):
+    """清理过期工作空间的命令：.lease超过ttl_hours未更新、且没有以该任务ID记录的进程组在运行；输出被删除的任务ID
+
+    建到一半被中断的临时目录一小时后清理。工作空间删除后，内容寻址存储中不再被任何工作空间硬链接
+    （链接数为1）、且超过ttl_hours没有被链接过的图片一并删除，中断上传留下的临时文件一小时后删除，
+    过期的取消标记也一并删除。
+    """
+    root = f"~/{WORKSPACE_ROOT}"
+    minutes = int(ttl_hours * 60)
+    return (
+        f"if [ -d {root} ]; then "
+        f"find {root} -mindepth 1 -maxdepth 1 -name '.tmp-*' -mmin +60 -exec rm -rf {{}} + ; "
+        f"for d in {root}/*/; do d=${{d%/}}; id=${{d##*/}}; [ -d \"$d\" ] || continue; "
+        f"[ -n \"$(find $d/.lease -mmin -{minutes} 2>/dev/null)\" ] && continue; "
+        f"p=~/{PID_DIR}/$id.pid; [ -f $p ] && kill -0 -- -$(cat $p) 2>/dev/null && continue; "
+        f"rm -rf $d && echo $id; done; fi; "
+        # 每次硬链接都会更新文件的ctime，按ctime判断最近是否被使用
+        f"find ~/{PID_DIR} -maxdepth 1 -name '*.cancel' -mmin +{minutes} -delete 2>/dev/null; "
+        f"find ~/{CAS_DIR} -maxdepth 1 -type f \\( -name '*.part' -mmin +60 "
+        f"-o -name '*.jpg' -links 1 -cmin +{minutes} \\) -delete 2>/dev/null; true"
+    )
@@ -0,0 +1,102 @@
+import re
+import codecs
+import threading
+from collections import deque
+
+# 阶段输出只保留最后这么多行，用于失败时的错误信息
+DEFAULT_TAIL_LINES = 200
+# 进度行，例如 "3/10"，或tqdm的 " 30%|███       | 3/10 [00:01<00:02]"
+PROGRESS_PATTERN = re.compile(r"(?:^|[\s|])(\d+)/(\d+)(?=$|[\s\[])")
+
+
+def parse_progress(line, pattern=PROGRESS_PATTERN):
+    """从一行输出中解析 (已完成, 总数)，不是进度行时返回None"""
+    match = pattern.search(line)
+    if not match:
+        return None
+    done, total = int(match.group(1)), int(match.group(2))
+    if total == 0 or done > total:
+        return None
+    return done, total
+
+
+# ============================================================
+#                        远程命令输出
+# ============================================================
+class OutputReader(threading.Thread):
+    """在后台线程中边到边读取一个输出流，按行（\\n或\\r结尾）回调 on_line(行)，只保留最后max_lines行
+
+    recv(n) 为通道的recv或recv_stderr，返回b""表示流结束。读取不等命令结束，
+    输出再多也不会占满SSH窗口而让远程进程阻塞。
+    """
+
+    def __init__(self, recv, on_line=None, max_lines=DEFAULT_TAIL_LINES):
+        super().__init__(daemon=True)
+        self.recv = recv
+        self.on_line = on_line
+        self.lines = deque(maxlen=max_lines)
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.pending = ""
+
+    def run(self):
+        for chunk in iter(lambda: self.recv(32768), b""):
+            self.feed(self.decoder.decode(chunk))
+        self.feed(self.decoder.decode(b"", final=True))
+        if self.pending:
+            self.emit(self.pending)
+
+    def feed(self, text):
+        """把新到的文本切成完整的行，不完整的留到下次"""
+        parts = re.split(r"\r\n|\r|\n", self.pending + text)
+        self.pending = parts.pop()
+        for line in parts:
+            self.emit(line)
+
+    def emit(self, line):
+        if not line.strip():
+            return
+        self.lines.append(line)
+        if self.on_line:
+            try:
+                self.on_line(line)
+            except Exception:
+                # 回调出错不能中断读取，否则远程进程会因输出无人读取而阻塞
+                pass
+
+    def text(self):
+        """保留的输出"""
+        return "\n".join(self.lines)
+
+
+def stream_command(ssh, command, on_line=None, max_lines=DEFAULT_TAIL_LINES):
+    """执行命令，stdout与stderr同时在后台线程中边到边读取，每行回调 on_line(行, 是否stderr)
+
+    返回 (退出码, stdout最后max_lines行, stderr最后max_lines行)。
+    """
+    _, stdout, _ = ssh.exec_command(command)
+    channel = stdout.channel
+    readers = [
+        OutputReader(
+            channel.recv_stderr if stderr else channel.recv,
+            (lambda line, stderr=stderr: on_line(line, stderr)) if on_line else None,
+            max_lines
+        )
+        for stderr in [False, True]
+    ]
+    for reader in readers:
+        reader.start()
+    code = channel.recv_exit_status()
+    for reader in readers:
+        reader.join()
+    return code, readers[0].text(), readers[1].text()
+
+
+def read_command(ssh, command):
+    """执行命令并等待结束，stdout与stderr同时读取（任何一方输出再多都不会阻塞），返回 (退出码, stdout, stderr)"""
+    _, stdout, stderr = ssh.exec_command(command)
+    errors = []
+    reader = threading.Thread(target=lambda: errors.append(stderr.read()), daemon=True)
+    reader.start()
+    output = stdout.read()
+    reader.join()
+    return stdout.channel.recv_exit_status(), output.decode(), errors[0].decode()
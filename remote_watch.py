@@ -0,0 +1,105 @@
+import threading
+
+
+# ============================================================
+#                        服务器产物监视
+# ============================================================
+class RemoteWatcher(threading.Thread):
+    """阶段运行期间监视服务器上的产物目录，文件写完后立即回调 on_file(产物名, 文件名)
+
+    服务器装有inotifywait时按close_write事件通知，否则通过SFTP轮询，
+    文件大小与修改时间在两次轮询间保持不变即视为写完。
+    finish() 在阶段结束后调用，会补齐监视期间尚未回调的文件。
+    """
+
+    def __init__(self, ssh, dirs, on_file, interval=1.0):
+        super().__init__(daemon=True)
+        self.ssh = ssh
+        self.dirs = dirs  # {产物名: 服务器目录}
+        self.on_file = on_file
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.done = set()
+        self.lock = threading.Lock()
+        self.channel = None
+        self.sftp = ssh.open_sftp()
+
+    def run(self):
+        try:
+            if self.inotify_available():
+                self.watch_inotify()
+            else:
+                self.poll()
+        except Exception:
+            # 监视失败不影响阶段执行，finish()会补齐全部文件
+            pass
+
+    def finish(self, sweep=True):
+        """停止监视；sweep为True时（阶段成功结束）回调所有尚未处理的文件"""
+        self.stop_event.set()
+        if self.channel:
+            self.channel.close()
+        self.join()
+        try:
+            if sweep:
+                for kind, attrs in self.list_dirs():
+                    for attr in attrs:
+                        self.report(kind, attr.filename)
+        finally:
+            self.sftp.close()
+
+    def report(self, kind, filename):
+        """每个文件只回调一次"""
+        with self.lock:
+            if (kind, filename) in self.done:
+                return
+            self.done.add((kind, filename))
+        self.on_file(kind, filename)
+
+    def list_dirs(self):
+        """列出各目录下的文件属性，目录不存在时跳过"""
+        for kind, remote_dir in self.dirs.items():
+            try:
+                yield kind, self.sftp.listdir_attr(remote_dir)
+            except IOError:
+                continue
+
+    def inotify_available(self):
+        """服务器上是否有inotifywait"""
+        _, stdout, _ = self.ssh.exec_command("command -v inotifywait")
+        return stdout.channel.recv_exit_status() == 0
+
+    def watch_inotify(self):
+        """通过inotifywait接收写完事件"""
+        kinds = {remote_dir.rstrip("/"): kind for kind, remote_dir in self.dirs.items()}
+        # 在家目录下以相对路径监视，事件中的%w与self.dirs中的目录一致
+        # 使用pty，通道关闭时服务器上的inotifywait随之收到SIGHUP退出
+        _, stdout, _ = self.ssh.exec_command(
+            "cd ~ && inotifywait -m -q -e close_write -e moved_to --format '%w|%f' "
+            + " ".join(kinds),
+            get_pty=True
+        )
+        self.channel = stdout.channel
+        if self.stop_event.is_set():
+            self.channel.close()
+            return
+        for line in stdout:
+            if self.stop_event.is_set():
+                break
+            watched, _, filename = line.strip().partition("|")
+            kind = kinds.get(watched.rstrip("/"))
+            if kind and filename:
+                self.report(kind, filename)
+
+    def poll(self):
+        """轮询目录，大小与修改时间稳定的文件视为写完"""
+        last_seen = {}
+        while not self.stop_event.is_set():
+            for kind, attrs in self.list_dirs():
+                for attr in attrs:
+                    key = (kind, attr.filename)
+                    signature = (attr.st_size, attr.st_mtime)
+                    if attr.st_size and last_seen.get(key) == signature:
+                        self.report(kind, attr.filename)
+                    last_seen[key] = signature
+            self.stop_event.wait(self.interval)
@@ -0,0 +1,114 @@
+import os
+import json
+import threading
+from remote_layout import REMOTE_PYTHON, WORKER_PATH, WORKER_PID_NAME, process_group_command
+
+LOCAL_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "udis_worker.py")
+
+
+class WorkerError(Exception):
+    """常驻进程不可用或已退出"""
+
+
+# ============================================================
+#                        常驻推理进程客户端
+# ============================================================
+class RemoteWorker:
+    """通过一个SSH通道驱动服务器上的常驻推理进程，按JSON行收发任务"""
+
+    def __init__(self, ssh, ready_timeout=300):
+        self.ssh = ssh
+        self.ready_timeout = ready_timeout
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.stdin = None
+        self.stdout = None
+        self.owner = None  # 正在执行的请求所属的任务ID，空闲时为None
+
+    def start(self):
+        """上传并启动常驻进程，等待其完成预热"""
+        with self.ssh.open_sftp() as sftp:
+            sftp.put(LOCAL_WORKER_SCRIPT, WORKER_PATH)
+        # 在独立进程组中运行，取消任务时可以连同它启动的子进程一起终止
+        self.stdin, self.stdout, _ = self.ssh.exec_command(
+            process_group_command(f"{REMOTE_PYTHON} -u ~/{WORKER_PATH}", WORKER_PID_NAME)
+        )
+        self.stdout.channel.settimeout(self.ready_timeout)
+        reply = self.read_reply()
+        if not reply.get("ready"):
+            raise WorkerError(f"常驻进程启动失败: {reply}")
+        # 任务耗时不可预知，预热完成后不再设超时
+        self.stdout.channel.settimeout(None)
+
+    def is_alive(self):
+        """常驻进程是否仍在运行"""
+        channel = self.stdout.channel if self.stdout else None
+        return channel is not None and channel.get_transport().is_active() and not channel.exit_status_ready()
+
+    def run(self, script, cwd=None, args=(), owner=None, cancelled=None):
+        """在常驻进程中执行阶段脚本，返回(退出码, 输出)
+
+        多个任务共用一个常驻进程时请求依次执行；owner为发起请求的任务ID，
+        cancelled（threading.Event）在排队期间被置位时不再执行，抛出WorkerError。
+        """
+        with self.lock:
+            # 先登记再检查取消：取消方先置位再读owner，两者总有一方能看到对方
+            self.owner = owner
+            try:
+                if cancelled is not None and cancelled.is_set():
+                    raise WorkerError("任务已取消")
+                self.next_id += 1
+                request = {"id": self.next_id, "script": f"~/{script}", "cwd": f"~/{cwd or ''}", "args": list(args)}
+                self.stdin.write(json.dumps(request) + "\n")
+                self.stdin.flush()
+                reply = self.read_reply()
+            except WorkerError:
+                raise
+            except Exception as e:
+                raise WorkerError(f"与常驻进程通信失败: {e}")
+            finally:
+                self.owner = None
+        return reply["exit_status"], reply["output"]
+
+    def read_reply(self):
+        """读取一行JSON响应"""
+        line = self.stdout.readline()
+        if not line:
+            raise WorkerError("常驻进程已退出")
+        return json.loads(line)
+
+    def close(self):
+        """关闭stdin，常驻进程随之退出"""
+        if self.stdin:
+            self.stdin.close()
+
+
+_workers = {}
+_worker_key_locks = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(key, ssh):
+    """获取key（连接池键）对应服务器上的常驻进程，不存在或已退出时重新启动
+
+    启动常驻进程要经过网络往返，只持有该key的锁，不阻塞其他服务器"""
+    with _workers_lock:
+        key_lock = _worker_key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        with _workers_lock:
+            worker = _workers.get(key)
+        if worker is not None and worker.ssh is ssh and worker.is_alive():
+            return worker
+        worker = RemoteWorker(ssh)
+        worker.start()
+        with _workers_lock:
+            _workers[key] = worker
+        return worker
+
+
+def discard_worker(key):
+    """丢弃已失效的常驻进程"""
+    with _workers_lock:
+        worker = _workers.pop(key, None)
+    if worker:
+        worker.close()
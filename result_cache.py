@@ -0,0 +1,136 @@
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "udis2")
+DEFAULT_MAX_BYTES = 2 << 30
+
+
+# ============================================================
+#                        本地结果缓存
+# ============================================================
+class ResultCache:
+    """按 (输入1哈希, 输入2哈希, 模型指纹) 缓存一组图片的全部产物，超出容量按LRU淘汰
+
+    索引保存在SQLite中，按键查找走主键索引，按访问时间淘汰走last_access索引，
+    条目数达到数万时查找与淘汰仍然不需要扫描全部条目。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS fingerprints (server TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)"
+            )
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def make_key(digest1, digest2, fingerprint):
+        """缓存键"""
+        return hashlib.sha256(f"{digest1}:{digest2}:{fingerprint}".encode()).hexdigest()
+
+    def entry_dir(self, key):
+        """条目目录，按键前两位分散到子目录"""
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """命中时返回 {产物名: 路径} 并刷新访问时间，未命中返回None"""
+        with self.lock:
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            entry = self.entry_dir(key)
+            if not os.path.isdir(entry):
+                # 条目目录被手动删除，同步清理索引
+                self._remove(key, row[0])
+                return None
+            with self.db:
+                self.db.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+        return {
+            os.path.splitext(name)[0]: os.path.join(entry, name)
+            for name in os.listdir(entry)
+        }
+
+    def put(self, key, files):
+        """保存一组产物 {产物名: 本地路径或图片内容bytes}，返回缓存中的路径"""
+        entry = self.entry_dir(key)
+        # 同一组可能同时被多个任务存入，各自在独立的临时目录中准备
+        tmp = f"{entry}.{uuid.uuid4().hex[:8]}.tmp"
+        os.makedirs(tmp)
+        size = 0
+        for kind, source in files.items():
+            target = os.path.join(tmp, f"{kind}.jpg")
+            if isinstance(source, bytes):
+                with open(target, "wb") as f:
+                    f.write(source)
+            else:
+                shutil.copyfile(source, target)
+            size += os.path.getsize(target)
+
+        with self.lock:
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._remove(key, row[0])
+            # 没有索引的条目目录（上次中途退出留下的）也先删掉，否则无法替换
+            shutil.rmtree(entry, ignore_errors=True)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                # 另一个进程刚存入了同一组，沿用它的条目
+                shutil.rmtree(tmp, ignore_errors=True)
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                    (key, size, time.time())
+                )
+            self.total += size
+            self._evict()
+        return {kind: os.path.join(entry, f"{kind}.jpg") for kind in files}
+
+    def get_fingerprint(self, server):
+        """服务器上次记录的模型指纹"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT fingerprint FROM fingerprints WHERE server = ?", (server,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_fingerprint(self, server, fingerprint):
+        """记录服务器当前的模型指纹"""
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO fingerprints (server, fingerprint) VALUES (?, ?)",
+                (server, fingerprint)
+            )
+
+    def _evict(self):
+        """淘汰最久未访问的条目直到总大小不超过上限"""
+        while self.total > self.max_bytes:
+            row = self.db.execute(
+                "SELECT key, size FROM entries ORDER BY last_access LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._remove(*row)
+
+    def _remove(self, key, size):
+        """删除条目文件与索引"""
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+        with self.db:
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self.total -= size
@@ -0,0 +1,95 @@
+import threading
+
+
+# ============================================================
+#                        SSH连接池
+# ============================================================
+class SSHPool:
+    """按 (host, port, user) 复用已认证的SSH连接，多个任务共享同一个Transport"""
+
+    def __init__(self, keepalive=30, timeout=15):
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._clients = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(ssh_info):
+        """连接池键：(主机, 端口, 用户名)"""
+        return (
+            ssh_info["hostname"],
+            int(ssh_info.get("port", 22)),
+            ssh_info.get("username", "root"),
+        )
+
+    @staticmethod
+    def is_alive(client):
+        """检查连接的Transport是否仍然可用"""
+        transport = client.get_transport() if client else None
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def has_live(self, ssh_info):
+        """池中是否已有可用连接"""
+        with self._lock:
+            client = self._clients.get(self.key(ssh_info))
+        return self.is_alive(client)
+
+    def get(self, ssh_info):
+        """获取已认证的连接，连接失效时自动重连"""
+        key = self.key(ssh_info)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # 同一服务器的握手串行进行，不同服务器互不阻塞
+        with key_lock:
+            with self._lock:
+                client = self._clients.get(key)
+            if self.is_alive(client):
+                return client
+            if client:
+                client.close()
+            client = self._connect(ssh_info)
+            with self._lock:
+                self._clients[key] = client
+            return client
+
+    def discard(self, ssh_info):
+        """关闭并移除指定服务器的连接"""
+        with self._lock:
+            client = self._clients.pop(self.key(ssh_info), None)
+        if client:
+            client.close()
+
+    def close_all(self):
+        """关闭池中所有连接"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    def _connect(self, ssh_info):
+        """建立新连接并开启keepalive"""
+        # paramiko及其加密后端导入较慢，推迟到第一次连接时
+        import paramiko
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(**ssh_info, timeout=self.timeout)
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+
+def preload():
+    """在后台线程中预先导入paramiko，界面显示后调用，第一次连接时不必再等待导入"""
+    threading.Thread(target=lambda: __import__("paramiko"), daemon=True).start()
+
+
+# 进程内共享的连接池
+shared_pool = SSHPool()
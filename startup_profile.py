@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+
+# 启动预算（毫秒）：从导入界面模块到窗口首次显示完成，超出时 --profile-startup 以非零状态退出
+STARTUP_BUDGET_MS = 600
+
+
+# ============================================================
+#                        启动耗时统计
+# ============================================================
+class StartupProfile:
+    """记录启动过程中各步骤的耗时，mark(名称) 记下距上一次mark经过的时间"""
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.steps = []  # [(名称, 毫秒), ...]
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.steps.append((name, (now - self.last) * 1000))
+        self.last = now
+
+    def total_ms(self):
+        """从开始到最后一次mark的总耗时"""
+        return (self.last - self.start) * 1000
+
+    def report(self, module, budget_ms=STARTUP_BUDGET_MS):
+        """启动耗时明细与导入耗时排行，返回 (报告文本, 是否在预算内)"""
+        total = self.total_ms()
+        lines = ["启动耗时（毫秒）:"]
+        lines += [f"  {ms:8.1f}  {name}" for name, ms in self.steps]
+        lines.append(f"  {total:8.1f}  合计（预算 {budget_ms}）")
+        lines.append(f"导入 {module} 耗时最多的模块（毫秒，含其依赖）:")
+        lines += [f"  {ms:8.1f}  {name}" for name, ms in import_breakdown(module)]
+        within = total <= budget_ms
+        lines.append("✅ 在启动预算内" if within else f"❌ 超出启动预算 {total - budget_ms:.1f} 毫秒")
+        return "\n".join(lines), within
+
+
+def import_breakdown(module, limit=10):
+    """在子进程中以 -X importtime 导入module，返回累计耗时最多的直接依赖 [(模块名, 毫秒), ...]"""
+    import subprocess
+
+    # 子进程要在模块所在目录下导入，不能沿用调用方的工作目录
+    loaded = sys.modules.get(module)
+    path = getattr(loaded, "__file__", None) or __file__
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(path))
+    )
+    # importtime先输出子模块再输出父模块，按缩进区分顶层模块与它的直接依赖
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                return sorted(children, key=lambda item: item[1], reverse=True)[:limit]
+            children = []
+        elif depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000))
+    return []
+
+
+# 进程内共享的启动统计，界面模块导入时开始计时
+startup = StartupProfile()
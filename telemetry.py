@@ -0,0 +1,37 @@
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+
+DEFAULT_RUN_LOG = os.path.join(os.path.expanduser("~"), ".cache", "udis2", "runs.jsonl")
+
+# 一个步骤的耗时记录：start/end为time.monotonic()，bytes为期间传输的字节数，
+# exit_status为步骤中最后一条服务器命令的退出码（没有执行命令时为None），index为组序号（整体步骤为None），
+# server为执行该步骤的服务器（主机:端口）
+Span = namedtuple("Span", ["job_id", "stage", "index", "start", "end", "bytes", "exit_status", "ok", "server"])
+
+
+def span_duration(span):
+    """步骤耗时（秒）"""
+    return span.end - span.start
+
+
+# ============================================================
+#                        运行日志
+# ============================================================
+class RunLog:
+    """把每个步骤的耗时记录追加到JSONL文件，一行一条，便于事后统计"""
+
+    def __init__(self, path=DEFAULT_RUN_LOG):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+
+    def append(self, span):
+        """追加一条记录，附带墙钟时间与耗时"""
+        record = dict(span._asdict(), duration=round(span_duration(span), 6), time=time.time())
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
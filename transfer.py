@@ -0,0 +1,227 @@
+import io
+import os
+import time
+import shlex
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# 逐个文件下载时每个文件约需的往返次数（open、stat、read、close）
+ROUND_TRIPS_PER_FILE = 4
+# 文件数达到该值，或打包预计节省的往返时间达到该值（秒）时改用打包传输
+BUNDLE_MIN_FILES = 16
+BUNDLE_MIN_SAVING = 0.5
+COMPRESSORS = {None: "", "gzip": " | gzip -1", "zstd": " | zstd -1 -q"}
+
+
+# ============================================================
+#                        并发传输
+# ============================================================
+class TransferEngine:
+    """在同一个Transport上开多个SFTP通道并发传输文件，每个工作线程使用自己的通道
+
+    文件多或链路延迟大时，download_bundle 在一次exec_command中让服务器把全部文件
+    打成tar流发回，本地边收边解包，只付出一次往返。
+    """
+
+    def __init__(self, ssh, concurrency=4):
+        self.ssh = ssh
+        self.concurrency = max(1, concurrency)
+        self.rtt = None
+        self.pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="transfer")
+        self.local = threading.local()
+        self.channels = []
+        self.lock = threading.Lock()
+
+    def channel(self):
+        """当前工作线程的SFTP通道，首次使用时打开"""
+        sftp = getattr(self.local, "sftp", None)
+        if sftp is None:
+            sftp = self.ssh.open_sftp()
+            self.local.sftp = sftp
+            with self.lock:
+                self.channels.append(sftp)
+        return sftp
+
+    def map(self, func, items, on_done=None):
+        """并发执行 func(sftp, item)，每完成一项调用 on_done(item, 返回值)，有失败时抛出第一个异常"""
+        futures = {self.pool.submit(self._call, func, item): item for item in items}
+        error = None
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            if on_done:
+                on_done(futures[future], result)
+        if error:
+            raise error
+
+    def submit(self, func, item, on_done=None):
+        """异步执行 func(sftp, item)，完成后在工作线程中调用 on_done(item, 返回值)，返回Future"""
+        def task():
+            result = self._call(func, item)
+            if on_done:
+                on_done(item, result)
+            return result
+        return self.pool.submit(task)
+
+    def download(self, files, on_done=None):
+        """并发下载 [(远程路径, 本地路径), ...]"""
+        self.map(lambda sftp, item: sftp.get(*item), files, on_done)
+
+    def upload(self, files, on_done=None):
+        """并发上传 [(本地路径, 远程路径), ...]"""
+        self.map(lambda sftp, item: sftp.put(*item), files, on_done)
+
+    def round_trip(self, samples=3):
+        """链路往返时间（秒），首次调用时测量并缓存"""
+        if self.rtt is None:
+            sftp = self.channel()
+            timings = []
+            for _ in range(samples):
+                start = time.monotonic()
+                sftp.stat(".")
+                timings.append(time.monotonic() - start)
+            self.rtt = min(timings)
+        return self.rtt
+
+    def prefers_bundle(self, count):
+        """按文件数与实测往返时间判断打包传输是否更快"""
+        if count >= BUNDLE_MIN_FILES:
+            return True
+        batches = -(-count // self.concurrency)
+        saving = (batches * ROUND_TRIPS_PER_FILE - 2) * self.round_trip()
+        return count > 1 and saving >= BUNDLE_MIN_SAVING
+
+    def download_bundle(self, files, compression=None, on_done=None, callback=None):
+        """在一个通道中以tar流下载 [(远程路径, 本地路径), ...]
+
+        远程路径相对家目录；本地路径为None时文件内容读入内存。每解出一个文件调用
+        on_done((远程路径, 本地路径), 内容)，写入磁盘的文件内容为None。
+        callback(远程路径) 返回该文件的字节进度回调。compression可选None、"gzip"、"zstd"。
+        """
+        import tarfile
+
+        targets = dict(files)
+        command = "cd ~ && tar -cf - -- " + " ".join(shlex.quote(path) for path in targets)
+        _, stdout, stderr = self.ssh.exec_command(command + COMPRESSORS[compression])
+        stream = stdout
+        if compression == "zstd":
+            import zstandard
+            stream = zstandard.ZstdDecompressor().stream_reader(stdout)
+        mode = "r|gz" if compression == "gzip" else "r|"
+        with tarfile.open(fileobj=stream, mode=mode) as tar:
+            for member in tar:
+                if member.name not in targets or not member.isfile():
+                    continue
+                local_path = targets[member.name]
+                progress = callback(member.name) if callback else None
+                if local_path is None:
+                    buffer = io.BytesIO()
+                    copy_stream(tar.extractfile(member), buffer, member.size, progress)
+                    data = buffer.getvalue()
+                else:
+                    copy_member(tar.extractfile(member), local_path, member.size, progress)
+                    data = None
+                if on_done:
+                    on_done((member.name, local_path), data)
+        if stdout.channel.recv_exit_status() != 0:
+            raise Exception(stderr.read().decode())
+
+    def close(self):
+        """等待进行中的传输结束并关闭全部通道"""
+        self.pool.shutdown(wait=True)
+        with self.lock:
+            channels = list(self.channels)
+            self.channels.clear()
+        for sftp in channels:
+            sftp.close()
+
+    def _call(self, func, item):
+        return func(self.channel(), item)
+
+
+def copy_member(source, local_path, size, progress=None):
+    """把tar成员写到本地，先写临时文件再改名，界面不会读到半个文件"""
+    tmp = f"{local_path}.part"
+    with open(tmp, "wb") as f:
+        copy_stream(source, f, size, progress)
+    os.replace(tmp, local_path)
+
+
+def copy_stream(source, target, size, progress=None, chunk_size=1 << 20):
+    """分块复制并回报进度"""
+    written = 0
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        target.write(chunk)
+        written += len(chunk)
+        if progress:
+            progress(written, size)
+
+
+def format_size(size):
+    """字节数转为便于阅读的字符串"""
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+# 已传字节、已知总字节、瞬时速率与平均速率（字节/秒）、预计剩余秒数（未知时为-1）
+TransferStats = namedtuple("TransferStats", ["done", "total", "rate", "average", "eta"])
+
+
+# ============================================================
+#                        传输进度
+# ============================================================
+class TransferProgress:
+    """汇总多个并发传输的字节进度，按最小间隔回调 on_update(TransferStats)
+
+    callback(键) 返回可直接传给SFTP put/putfo/get 的回调；总字节数随各文件开始传输逐步得知。
+    瞬时速率取相邻两次回报之间的速率并做指数平滑，避免进度条上的数字来回跳。
+    """
+
+    def __init__(self, on_update, interval=0.25, smoothing=0.3):
+        self.on_update = on_update
+        self.interval = interval
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.files = {}  # {键: (已传字节, 文件总字节)}
+        self.done = 0
+        self.total = 0
+        self.started = None
+        self.last_time = None
+        self.last_done = 0
+        self.rate = 0.0
+
+    def callback(self, key):
+        """键为key的文件的进度回调"""
+        return lambda transferred, total: self.update(key, transferred, total)
+
+    def update(self, key, transferred, total):
+        """记录一个文件的进度，距上次回报超过interval或全部传完时回报一次"""
+        now = time.monotonic()
+        with self.lock:
+            old_done, old_total = self.files.get(key, (0, 0))
+            self.files[key] = (transferred, total)
+            self.done += transferred - old_done
+            self.total += total - old_total
+            if self.started is None:
+                self.started = self.last_time = now
+            done, total = self.done, self.total
+            elapsed = now - self.last_time
+            if elapsed < self.interval and done < total:
+                return
+            if elapsed > 0:
+                rate = (done - self.last_done) / elapsed
+                self.rate = rate if self.rate == 0 else self.smoothing * rate + (1 - self.smoothing) * self.rate
+            self.last_time = now
+            self.last_done = done
+            average = done / (now - self.started) if now > self.started else 0.0
+            eta = (total - done) / self.rate if self.rate > 0 else -1.0
+            stats = TransferStats(done, total, self.rate, average, eta)
+        self.on_update(stats)
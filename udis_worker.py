@@ -0,0 +1,105 @@
+"""在GPU服务器上运行的常驻推理进程
+
+由客户端上传并通过SSH通道启动，从stdin逐行读取JSON任务，向stdout逐行返回JSON结果：
+    请求: {"id": 1, "script": "~/.../test_output.py", "cwd": "~", "args": []}
+    响应: {"id": 1, "exit_status": 0, "output": "..."}
+进程内保持torch、CUDA上下文和已加载的模型权重常驻，阶段脚本通过runpy在进程内执行，
+不再为每个任务重新启动Python。stdin关闭（SSH断开）时退出。
+"""
+import io
+import os
+import sys
+import json
+import runpy
+import traceback
+import contextlib
+
+LOG_PATH = os.path.expanduser("~/autodl-tmp/udis_worker.log")
+
+# 协议只走原始stdout，其余输出（包括C扩展直接写fd的内容）写入日志文件
+protocol = os.fdopen(os.dup(1), "w", buffering=1)
+log_file = open(LOG_PATH, "a", buffering=1)
+os.dup2(log_file.fileno(), 1)
+os.dup2(log_file.fileno(), 2)
+sys.stdout = sys.stderr = log_file
+
+# 各阶段脚本目录下导入的模块（Warp与Composition都有network.py等同名模块，需分开保存）
+stage_modules = {}
+
+
+def warm_up():
+    """导入torch、初始化CUDA，并让torch.load对同一权重文件只读取一次"""
+    try:
+        import torch
+    except ImportError:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.init()
+
+    original_load = torch.load
+    loaded = {}
+
+    def cached_load(f, *args, **kwargs):
+        if not isinstance(f, (str, os.PathLike)):
+            return original_load(f, *args, **kwargs)
+        path = os.path.abspath(f)
+        key = (path, os.stat(path).st_mtime_ns, repr(args), repr(sorted(kwargs.items())))
+        if key not in loaded:
+            loaded[key] = original_load(f, *args, **kwargs)
+        return loaded[key]
+
+    torch.load = cached_load
+
+
+def module_dir(module):
+    """模块文件所在目录，内置模块返回None"""
+    path = getattr(module, "__file__", None)
+    return os.path.dirname(os.path.abspath(path)) if path else None
+
+
+def run_job(job):
+    """在进程内执行一个阶段脚本，返回(退出码, 输出)"""
+    script = os.path.abspath(os.path.expanduser(job["script"]))
+    script_dir = os.path.dirname(script)
+    cwd = os.path.expanduser(job.get("cwd") or "~")
+
+    sys.modules.update(stage_modules.get(script_dir, {}))
+    sys.path.insert(0, script_dir)
+    # 参数中的 ~/ 路径（例如任务工作空间）在这里展开，与shell中执行时一致
+    sys.argv = [script] + [os.path.expanduser(arg) for arg in job.get("args", [])]
+    os.chdir(cwd)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            runpy.run_path(script, run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        output.write(traceback.format_exc())
+        code = 1
+    finally:
+        sys.path.remove(script_dir)
+        local = {
+            name: module for name, module in sys.modules.items()
+            if module_dir(module) == script_dir
+        }
+        stage_modules.setdefault(script_dir, {}).update(local)
+        for name in local:
+            del sys.modules[name]
+    return code, output.getvalue()
+
+
+def main():
+    warm_up()
+    protocol.write(json.dumps({"ready": True}) + "\n")
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        code, output = run_job(job)
+        protocol.write(json.dumps({"id": job.get("id"), "exit_status": code, "output": output}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import io
+import os
+import uuid
+import hashlib
+from functools import lru_cache
+from remote_layout import CAS_DIR
+
+
+def file_digest(path):
+    """本地文件的SHA-256，文件未变化时复用上次的结果"""
+    st = os.stat(path)
+    return _file_digest(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+@lru_cache(maxsize=4096)
+def _file_digest(path, size, mtime_ns, chunk_size=1 << 20):
+    """流式计算SHA-256，size与mtime_ns只作为缓存键"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ============================================================
+#                        内容寻址上传
+# ============================================================
+class ContentStore:
+    """服务器端按内容哈希保存上传过的图片，重复内容只在服务器上做硬链接
+
+    不再被任何工作空间链接的图片超过保留期后由工作空间的过期清理删除（见remote_layout.collect_workspaces_command）。
+    """
+
+    def __init__(self, ssh, sftp):
+        self.ssh = ssh
+        self.sftp = sftp
+        self.ready = False
+
+    def exists(self, remote_path, sftp=None):
+        """服务器上是否已有该文件"""
+        try:
+            (sftp or self.sftp).stat(remote_path)
+            return True
+        except IOError:
+            return False
+
+    def put(self, local_path, remote_path, sftp=None, data=None, callback=None):
+        """把local_path放到remote_path，返回是否真正经网络上传
+
+        sftp指定本次使用的通道，并发上传时每个线程传入自己的通道。
+        data为预处理后的图片内容时按data的哈希存储并直接从内存上传，不读取local_path。
+        callback为SFTP字节进度回调 callback(已传字节, 总字节)。
+        """
+        sftp = sftp or self.sftp
+        if not self.ready:
+            self.run(f"mkdir -p ~/{CAS_DIR}")
+            self.ready = True
+        digest = hashlib.sha256(data).hexdigest() if data is not None else file_digest(local_path)
+        stored = f"{CAS_DIR}/{digest}.jpg"
+        link = f"(ln -f ~/{stored} ~/{remote_path} 2>/dev/null || cp -f ~/{stored} ~/{remote_path})"
+        if self.exists(stored, sftp):
+            try:
+                self.run(link)
+                return False
+            except Exception:
+                # 刚好被过期清理删除，重新上传
+                if self.exists(stored, sftp):
+                    raise
+        # 先传到临时名再改名，避免并发任务看到半个文件
+        tmp = f"{stored}.{uuid.uuid4().hex}.part"
+        if data is not None:
+            sftp.putfo(io.BytesIO(data), tmp, len(data), callback=callback)
+        else:
+            sftp.put(local_path, tmp, callback=callback)
+        self.run(f"mv -f ~/{tmp} ~/{stored} && {link}")
+        return True
+
+    def run(self, command):
+        """执行命令并等待完成"""
+        _, stdout, stderr = self.ssh.exec_command(command)
+        if stdout.channel.recv_exit_status() != 0:
+            raise Exception(stderr.read().decode())